@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+分块布局基准：比较不同分块/压缩方案下的整图读取、单点时间序列读取与文件大小
+
+示例:
+    python benchmarks/bench_layouts.py --synthetic --shape 365 720 1440
+    python benchmarks/bench_layouts.py --files data/glo12v1_daily_2022.nc --variable thetao
+"""
+import sys
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any, List
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+import argparse
+import netCDF4
+import numpy as np
+
+from utils.nc_io import find_time_dim
+from utils.rechunk import rechunk_file
+
+# 默认候选布局：按时间切片的整图布局、均衡布局、时间序列布局
+DEFAULT_LAYOUTS: Dict[str, Dict[str, Any]] = {
+    'map': {'chunks': {'time': 1, 'valid_time': 1}, 'compression': 'zlib', 'complevel': 4},
+    'balanced': {'chunks': {'time': 24, 'valid_time': 24, 'latitude': 128, 'longitude': 128,
+                            'depth': 1},
+                 'compression': 'zlib', 'complevel': 4},
+    'timeseries': {'chunks': {'time': 365, 'valid_time': 365, 'latitude': 16, 'longitude': 16,
+                              'depth': 1},
+                   'compression': 'zlib', 'complevel': 4},
+    'map_zlib1': {'chunks': {'time': 1, 'valid_time': 1}, 'compression': 'zlib', 'complevel': 1},
+}
+
+
+def make_synthetic(path: Path, shape: List[int], variable: str) -> None:
+    """生成平滑场加噪声的合成文件（time, latitude, longitude）"""
+    nt, ny, nx = shape
+    rng = np.random.default_rng(0)
+    with netCDF4.Dataset(path, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('latitude', ny)
+        ds.createDimension('longitude', nx)
+        t = ds.createVariable('time', 'f8', ('time',))
+        t.units = 'days since 2000-01-01'
+        ds.createVariable('latitude', 'f4', ('latitude',))[:] = np.linspace(-90, 90, ny)
+        ds.createVariable('longitude', 'f4', ('longitude',))[:] = np.linspace(-180, 180, nx,
+                                                                             endpoint=False)
+        var = ds.createVariable(variable, 'f4', ('time', 'latitude', 'longitude'),
+                                chunksizes=(1, ny, nx))
+        base = np.cos(np.linspace(0, np.pi, ny))[:, None] * np.sin(np.linspace(0, 4 * np.pi, nx))
+        for i in range(nt):
+            t[i] = i
+            var[i] = (base * 10 + 15 + rng.normal(0, 0.1, (ny, nx))).astype('f4')
+
+
+def measure(path: Path, variable: str, repeats: int) -> Dict[str, float]:
+    """测量整图与单点时间序列读取耗时（毫秒，取中位数）"""
+    rng = np.random.default_rng(1)
+    map_times, point_times = [], []
+    with netCDF4.Dataset(path) as ds:
+        var = ds.variables[variable]
+        time_dim = find_time_dim(ds)
+        axis = var.dimensions.index(time_dim)
+        for _ in range(repeats):
+            # 整图：随机时间步、首层、完整的最后两维（纬度/经度）
+            map_index = [0] * var.ndim
+            map_index[axis] = int(rng.integers(var.shape[axis]))
+            map_index[-2:] = [slice(None), slice(None)]
+            map_index = tuple(map_index)
+            start = time.perf_counter()
+            var[map_index]
+            map_times.append(time.perf_counter() - start)
+
+            point_index = tuple(slice(None) if i == axis else int(rng.integers(n))
+                                for i, n in enumerate(var.shape))
+            start = time.perf_counter()
+            var[point_index]
+            point_times.append(time.perf_counter() - start)
+
+    return {
+        'map_read_ms': float(np.median(map_times) * 1000),
+        'point_series_ms': float(np.median(point_times) * 1000),
+        'size_mb': path.stat().st_size / 1024 / 1024,
+    }
+
+
+def run(sources: List[Path], variable: str, layouts: Dict[str, Dict[str, Any]],
+        repeats: int, workdir: Path) -> List[Dict[str, Any]]:
+    rows = []
+    for source in sources:
+        baseline = measure(source, variable, repeats)
+        rows.append(dict(baseline, file=source.name, layout='original', write_s=0.0))
+        for name, options in layouts.items():
+            target = workdir / f"{source.stem}.{name}.nc"
+            start = time.perf_counter()
+            if not rechunk_file(source, target, options):
+                continue
+            write_s = time.perf_counter() - start
+            rows.append(dict(measure(target, variable, repeats),
+                             file=source.name, layout=name, write_s=write_s))
+            target.unlink()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NetCDF分块布局基准')
+    parser.add_argument('--files', type=str, nargs='+', help='真实文件路径')
+    parser.add_argument('--synthetic', action='store_true', help='使用合成数据')
+    parser.add_argument('--shape', type=int, nargs=3, default=[365, 360, 720],
+                        help='合成数据形状 (time lat lon)')
+    parser.add_argument('--variable', type=str, default='thetao', help='测试变量名')
+    parser.add_argument('--layouts', type=str,
+                        help='布局定义 JSON 文件（名称 -> rechunk 参数）')
+    parser.add_argument('--repeats', type=int, default=20, help='每项重复次数')
+    parser.add_argument('--json', type=str, help='结果输出 JSON 路径')
+
+    args = parser.parse_args()
+    if not args.files and not args.synthetic:
+        parser.error('需要指定 --files 或 --synthetic')
+
+    layouts = DEFAULT_LAYOUTS
+    if args.layouts:
+        with open(args.layouts, 'r', encoding='utf-8') as f:
+            layouts = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        sources = [Path(p) for p in (args.files or [])]
+        if args.synthetic:
+            synthetic = workdir / 'synthetic.nc'
+            make_synthetic(synthetic, args.shape, args.variable)
+            sources.append(synthetic)
+        rows = run(sources, args.variable, layouts, args.repeats, workdir)
+
+    # 注意：结果包含操作系统页缓存的影响，冷读取需在清空缓存后单独测量
+    print(f"{'file':<28}{'layout':<14}{'map_ms':>10}{'point_ms':>12}{'size_mb':>10}{'write_s':>10}")
+    for row in rows:
+        print(f"{row['file']:<28}{row['layout']:<14}{row['map_read_ms']:>10.2f}"
+              f"{row['point_series_ms']:>12.2f}{row['size_mb']:>10.1f}{row['write_s']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
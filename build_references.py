@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+引用索引构建命令行工具
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.config_manager import ConfigManager
+from utils.reference_index import build_reference_index, open_reference_dataset
+import argparse
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description='扫描归档文件，建立/增量更新引用索引')
+    parser.add_argument('--dataset', type=str, nargs='+', required=True,
+                        help='数据集名称（可多个，例如 era5_daily glo12v1_daily）')
+    parser.add_argument('--config', type=str, default='./config/config.yaml',
+                        help='配置文件路径')
+    parser.add_argument('--workers', type=int, help='并行扫描进程数')
+    parser.add_argument('--check', action='store_true',
+                        help='建立后通过索引打开数据集并打印概要')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    config_manager = ConfigManager()
+    config = config_manager.load_config(args.config)
+
+    for dataset_name in args.dataset:
+        combined = build_reference_index(config, dataset_name, args.workers)
+        if combined is None:
+            print(f"{dataset_name}: 没有可索引的文件")
+            continue
+        print(f"{dataset_name}: {combined}")
+        if args.check:
+            print(open_reference_dataset(config, dataset_name, update=False))
+
+
+if __name__ == "__main__":
+    main()
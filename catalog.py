@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+数据集元数据目录命令行工具
+"""
+import sys
+from pathlib import Path
+from datetime import datetime
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.config_manager import ConfigManager
+import argparse
+import json
+import logging
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='刷新/查看本地缓存的数据集元数据（变量、网格范围、时间轴）')
+    parser.add_argument('--config', type=str, default='./config/config.yaml',
+                        help='配置文件路径')
+    parser.add_argument('--service', type=str, choices=['c3s', 'cmems'], nargs='+',
+                        default=['c3s', 'cmems'], help='服务')
+    parser.add_argument('--dataset', type=str, nargs='+',
+                        help='配置中的数据集名称，默认为该服务的全部数据集')
+    parser.add_argument('--refresh', action='store_true', help='忽略 TTL，强制从服务端刷新')
+    parser.add_argument('--offline', action='store_true', help='只读取本地缓存')
+    parser.add_argument('--show', action='store_true', help='打印完整元数据')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    config_manager = ConfigManager()
+    config = config_manager.load_config(args.config)
+    if args.offline:
+        config.setdefault('general', {}).setdefault('catalog', {})['offline'] = True
+
+    for service in args.service:
+        if service == 'c3s':
+            from downloaders.c3s_downloader import C3SDownloader
+            downloader = C3SDownloader(config)
+        else:
+            from downloaders.cmems_downloader import CMEMSDownloader
+            downloader = CMEMSDownloader(config)
+
+        names = args.dataset or list(downloader.service_config.get('datasets', {}))
+        for name in names:
+            if name not in downloader.service_config.get('datasets', {}):
+                continue
+            metadata = downloader.dataset_metadata(name, refresh=args.refresh)
+            if metadata is None:
+                print(f"{service}/{name}: 无元数据")
+                continue
+            fetched = datetime.fromtimestamp(metadata['fetched_at']).strftime('%Y-%m-%d %H:%M')
+            time_coord = metadata.get('coordinates', {}).get('time') or {}
+            print(f"{service}/{name} ({metadata['dataset_id']}): "
+                  f"{len(metadata.get('variables') or {})} 个变量, "
+                  f"时间 {time_coord.get('min')} ~ {time_coord.get('max')}, 缓存于 {fetched}")
+            if args.show:
+                print(json.dumps(metadata, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
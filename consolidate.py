@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+逐日文件合并命令行工具
+"""
+import sys
+from pathlib import Path
+from datetime import datetime, timedelta
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.config_manager import ConfigManager
+from utils.consolidate import consolidate
+import argparse
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description='逐日NetCDF文件合并工具')
+    parser.add_argument('--dataset', type=str, required=True,
+                        help='数据集名称')
+    parser.add_argument('--config', type=str, default='./config/config.yaml',
+                        help='配置文件路径')
+    parser.add_argument('--period', type=str, choices=['monthly', 'yearly'],
+                        help='合并周期')
+    parser.add_argument('--start_date', type=str,
+                        help='起始月份 (YYYY-MM)')
+    parser.add_argument('--end_date', type=str,
+                        help='结束月份 (YYYY-MM)')
+    parser.add_argument('--output_dir', type=str, help='逐日文件所在目录')
+    parser.add_argument('--target_dir', type=str, help='合并文件输出目录')
+    parser.add_argument('--workers', type=int, help='并行进程数')
+    parser.add_argument('--max_memory_mb', type=int, help='单进程内存上限 (MB)')
+    parser.add_argument('--remove_sources', action='store_true',
+                        help='校验通过后删除源文件')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    config_manager = ConfigManager()
+    config = config_manager.load_config(args.config)
+
+    general_cfg = config.get('general', {})
+    source_dir = args.output_dir or general_cfg.get('output_base_dir', './data')
+
+    options = dict(config.get('processing', {}).get('consolidate') or {})
+    target_dir = args.target_dir or options.pop('target_dir', None)
+    for key in ('period', 'workers', 'max_memory_mb'):
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+    if args.remove_sources:
+        options['remove_sources'] = True
+
+    start = datetime.strptime(args.start_date, "%Y-%m") if args.start_date else None
+    end = None
+    if args.end_date:
+        end_month = datetime.strptime(args.end_date, "%Y-%m")
+        # 归档查询为闭区间，取结束月份的最后一刻，避免把下月 1 日单独分成一组
+        end = datetime(end_month.year + end_month.month // 12, end_month.month % 12 + 1, 1) \
+            - timedelta(microseconds=1)
+
+    results = consolidate(Path(source_dir), args.dataset, options,
+                          target_dir=Path(target_dir) if target_dir else None,
+                          start=start, end=end)
+
+    success_count = sum(1 for r in results.values() if r)
+    total_count = len(results)
+
+    print(f"\n合并完成!")
+    print(f"成功: {success_count}/{total_count}")
+    print(f"失败: {total_count - success_count}/{total_count}")
+
+
+if __name__ == "__main__":
+    main()
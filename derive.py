@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+派生变量批量计算命令行工具
+"""
+import sys
+from pathlib import Path
+from datetime import datetime
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.config_manager import ConfigManager
+from utils.derived import DERIVED_VARIABLES, derive_archive
+import argparse
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description='为已下载的归档文件计算派生变量')
+    parser.add_argument('--dataset', type=str, required=True,
+                        help='数据集名称（例如 era5_hourly）')
+    parser.add_argument('--config', type=str, default='./config/config.yaml',
+                        help='配置文件路径')
+    parser.add_argument('--variables', type=str, nargs='+',
+                        choices=sorted(DERIVED_VARIABLES),
+                        help='要计算的派生变量，默认使用配置中的 derived 列表')
+    parser.add_argument('--mode', type=str, choices=['inplace', 'sidecar'],
+                        help='写入方式：inplace 追加到原文件，sidecar 写入旁路文件')
+    parser.add_argument('--start_date', type=str, help='起始日期 (YYYY-MM-DD)')
+    parser.add_argument('--end_date', type=str, help='结束日期 (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, help='并行进程数')
+    parser.add_argument('--overwrite', action='store_true', help='重新计算已存在的派生变量')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    config_manager = ConfigManager()
+    config = config_manager.load_config(args.config)
+
+    options = {}
+    if args.mode:
+        options['mode'] = args.mode
+    if args.workers:
+        options['workers'] = args.workers
+
+    start = datetime.strptime(args.start_date, "%Y-%m-%d") if args.start_date else None
+    end = datetime.strptime(args.end_date, "%Y-%m-%d") if args.end_date else None
+    results = derive_archive(config, args.dataset, args.variables, options,
+                             start, end, args.overwrite)
+
+    success_count = sum(1 for r in results.values() if r)
+    total_count = len(results)
+
+    print(f"\n派生变量计算完成!")
+    print(f"成功: {success_count}/{total_count}")
+    print(f"失败: {total_count - success_count}/{total_count}")
+
+
+if __name__ == "__main__":
+    main()
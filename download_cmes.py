@@ -11,6 +11,8 @@ sys.path.insert(0, str(project_root))
 
 from downloaders.cmems_downloader import CMEMSDownloader
 from utils.config_manager import ConfigManager
+from utils.profiling import Profiler
+from contextlib import nullcontext
 import argparse
 
 import os
@@ -37,6 +39,18 @@ def main():
                         help='要下载的变量列表')
     parser.add_argument('--is_hourly', action='store_true',
                         help='将 YYYY-MM-DD 视为小时级数据')
+    parser.add_argument('--priority', type=int, default=0,
+                        help='任务优先级，数值越大越先执行（可插队到正在回填的队列前）')
+    parser.add_argument('--order', type=str, choices=['chronological', 'recent_first'],
+                        help='同优先级任务的执行顺序')
+    parser.add_argument('--resume_queue', action='store_true',
+                        help='仅继续处理持久化队列中的剩余任务')
+    parser.add_argument('--distributed', action='store_true',
+                        help='分布式模式：多台机器通过共享输出目录中的队列以租约分摊任务')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='根据请求耗时/大小/失败自动调整每个请求包含的天数、变量与空间范围')
+    parser.add_argument('--profile', type=str, nargs='?', const='./profile',
+                        help='开启分阶段性能剖析，结果写入指定目录（默认 ./profile）')
     parser.add_argument('--use_cli', action='store_true',
                         help='使用命命令行参数覆盖配置')
 
@@ -50,8 +64,11 @@ def main():
         return
 
     # 加载配置
+    profiler = Profiler(Path(args.profile)) if args.profile else None
+
     config_manager = ConfigManager()
-    config = config_manager.load_config(args.config)
+    with profiler.phase('config_load') if profiler else nullcontext():
+        config = config_manager.load_config(args.config)
 
     # 覆盖配置中的输出目录
     if args.output_dir:
@@ -59,6 +76,17 @@ def main():
 
     # 创建下载器
     downloader = CMEMSDownloader(config)
+    if args.adaptive:
+        adaptive_cfg = config.get('general', {}).get('adaptive') or {}
+        downloader.enable_adaptive(**{key: value for key, value in adaptive_cfg.items()
+                                      if key != 'enabled'})
+    if args.distributed:
+        distributed_cfg = config.get('general', {}).get('distributed') or {}
+        downloader.enable_distributed(distributed_cfg.get('queue_path'),
+                                      distributed_cfg.get('lease_seconds', 600),
+                                      distributed_cfg.get('heartbeat_interval'))
+    if profiler:
+        downloader.set_profiler(profiler)
 
     cmems_cfg = config.get('cmems', {})
     cmems_defaults = cmems_cfg.get('download_parameters') or cmems_cfg.get('download_defaults', {})
@@ -88,30 +116,40 @@ def main():
                 return 'hourly' if is_hourly else 'daily'
         raise ValueError("无法判断下载粒度，请提供合法的 start_date/end_date")
 
-    mode = infer_mode()
+    mode = 'resume' if args.resume_queue else infer_mode()
 
     # 执行下载
-    if mode == 'hourly':
+    if mode == 'resume':
+        if not downloader.connect():
+            raise RuntimeError("无法连接到CMEMS服务")
+        results = downloader.process_queue()
+    elif mode == 'hourly':
         results = downloader.download_hourly_range(
             start_date=start_date,
             end_date=end_date,
             dataset_name=dataset_name,
             variables=variables,
-            hours=hours
+            hours=hours,
+            priority=args.priority,
+            order=args.order
         )
     elif mode == 'daily':
         results = downloader.download_daily_range(
             start_date=start_date,
             end_date=end_date,
             dataset_name=dataset_name,
-            variables=variables
+            variables=variables,
+            priority=args.priority,
+            order=args.order
         )
     else:
         results = downloader.download_monthly_range(
             start_date=start_date,
             end_date=end_date,
             dataset_name=dataset_name,
-            variables=variables
+            variables=variables,
+            priority=args.priority,
+            order=args.order
         )
 
     # 统计结果
@@ -122,6 +160,11 @@ def main():
     print(f"成功: {success_count}/{total_count}")
     print(f"失败: {total_count - success_count}/{total_count}")
 
+    # --profile 挂载的剖析器，或配置 general.profiling.enabled 创建的剖析器
+    if downloader.profiler is not None:
+        report_dir = downloader.profiler.write_report()
+        print(f"\n剖析结果: {report_dir}")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+自适应请求粒度：按每次请求的耗时、字节数与失败情况调整每个请求包含的天数、变量数与空间分块
+"""
+import logging
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    'max_days': 16,              # 单个请求最多合并的天数
+    'max_variable_groups': 4,    # 变量最多拆成几组分别请求
+    'max_tiles': 4,              # 空间范围最多按纬度拆成几块
+    'max_latency': 900,          # 单个请求耗时上限（秒），超过则减小粒度
+    'samples_per_level': 2,      # 每个粒度至少观测几次再决定是否调整
+    'tolerance': 0.1,            # 吞吐量相对提升超过该比例才视为更优
+    'smoothing': 0.5,            # 吞吐量指数平滑系数
+    'max_failures': 2,           # 同一粒度连续失败几次后本次运行不再尝试该粒度及更大的粒度
+}
+
+
+def _halvings(maximum: int) -> List[int]:
+    """maximum, maximum/2, ..., 2（用于拆分级别）"""
+    values = []
+    value = max(1, int(maximum))
+    while value > 1:
+        values.append(value)
+        value //= 2
+    return values
+
+
+def build_levels(limits: Dict[str, Any], n_variables: int,
+                 has_bbox: bool) -> List[Dict[str, int]]:
+    """由小到大排列的粒度阶梯
+
+    先拆空间、再拆变量，都不拆之后逐步合并天数：
+    (tiles=4) → (tiles=2) → (groups=4) → (groups=2) → (days=1) → (days=2) → ...
+    """
+    levels = []
+    max_groups = min(int(limits['max_variable_groups']), max(1, n_variables))
+    max_groups_level = _halvings(max_groups)[0] if max_groups > 1 else 1
+    if has_bbox:
+        for tiles in _halvings(limits['max_tiles']):
+            levels.append({'days': 1, 'var_groups': max_groups_level, 'tiles': tiles})
+    for groups in _halvings(max_groups):
+        levels.append({'days': 1, 'var_groups': groups, 'tiles': 1})
+    days = 1
+    while days <= int(limits['max_days']):
+        levels.append({'days': days, 'var_groups': 1, 'tiles': 1})
+        days *= 2
+    return levels
+
+
+class AdaptiveTuner:
+    """按数据集爬山调整请求粒度
+
+    每个粒度记录平滑后的吞吐量（字节/秒）。观测足够后：若更大一级未试过或吞吐量更高，
+    且单次耗时未超上限，则增大粒度；若更小一级吞吐量更高则减小。请求失败立即减小一级；
+    同一粒度连续失败 max_failures 次（而非偶发的网络错误）后，本次运行不再尝试该粒度。
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Any]] = None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.states: Dict[str, Dict[str, Any]] = {}
+
+    def ensure(self, dataset: str, n_variables: int, has_bbox: bool,
+               overrides: Optional[Dict[str, Any]] = None) -> None:
+        """初始化数据集的粒度阶梯，起点为原有的“一天一个请求”"""
+        if dataset in self.states:
+            return
+        limits = dict(self.limits)
+        limits.update(overrides or {})
+        levels = build_levels(limits, n_variables, has_bbox)
+        start = next(i for i, level in enumerate(levels)
+                     if level == {'days': 1, 'var_groups': 1, 'tiles': 1})
+        self.states[dataset] = {
+            'limits': limits,
+            'levels': levels,
+            'index': start,
+            'ceiling': len(levels) - 1,
+            'stats': [{'throughput': None, 'samples': 0, 'failures': 0, 'consecutive': 0}
+                      for _ in levels],
+        }
+
+    def current(self, dataset: str) -> Dict[str, int]:
+        state = self.states[dataset]
+        return dict(state['levels'][state['index']])
+
+    def is_smallest(self, dataset: str, level: Dict[str, int]) -> bool:
+        return self.states[dataset]['levels'][0] == level
+
+    def record(self, dataset: str, level: Dict[str, int], days: int,
+               nbytes: int, latency: float, success: bool) -> None:
+        """记录一次请求的结果并调整粒度"""
+        state = self.states[dataset]
+        index = state['levels'].index(level)
+        stats = state['stats'][index]
+        limits = state['limits']
+
+        if not success:
+            stats['failures'] += 1
+            stats['consecutive'] += 1
+            if stats['consecutive'] >= int(limits['max_failures']):
+                state['ceiling'] = min(state['ceiling'], max(index - 1, 0))
+            self._move(dataset, min(max(index - 1, 0), state['ceiling']), "请求失败")
+            return
+        stats['consecutive'] = 0
+
+        # 天数未取满（队列中剩余任务不足）时不计入该粒度的观测
+        if days < level['days'] or latency <= 0:
+            return
+        throughput = nbytes / latency
+        alpha = float(limits['smoothing'])
+        stats['throughput'] = (throughput if stats['throughput'] is None
+                               else alpha * throughput + (1 - alpha) * stats['throughput'])
+        stats['samples'] += 1
+        if index != state['index'] or stats['samples'] < int(limits['samples_per_level']):
+            return
+
+        tolerance = 1 + float(limits['tolerance'])
+        current = stats['throughput']
+        if latency > float(limits['max_latency']) and index > 0:
+            self._move(dataset, index - 1, f"单次耗时 {latency:.0f}s 超过上限")
+            return
+        if index < state['ceiling']:
+            upper = state['stats'][index + 1]['throughput']
+            if upper is None or upper > current * tolerance:
+                self._move(dataset, index + 1, f"吞吐量 {current / 1e6:.2f} MB/s")
+                return
+        if index > 0:
+            lower = state['stats'][index - 1]['throughput']
+            if lower is not None and lower > current * tolerance:
+                self._move(dataset, index - 1, f"吞吐量 {current / 1e6:.2f} MB/s")
+
+    def _move(self, dataset: str, index: int, reason: str) -> None:
+        state = self.states[dataset]
+        if index == state['index']:
+            return
+        old, new = state['levels'][state['index']], state['levels'][index]
+        state['index'] = index
+        logger.info(f"{dataset} 请求粒度调整 ({reason}): "
+                    f"天数 {old['days']}→{new['days']}, 变量分组 {old['var_groups']}→{new['var_groups']}, "
+                    f"空间分块 {old['tiles']}→{new['tiles']}")
+
+    def summary(self) -> Dict[str, Any]:
+        """各数据集当前粒度与已观测的吞吐量"""
+        result = {}
+        for dataset, state in self.states.items():
+            result[dataset] = {
+                'current': self.current(dataset),
+                'throughput': [
+                    dict(level, throughput=stats['throughput'], failures=stats['failures'])
+                    for level, stats in zip(state['levels'], state['stats'])
+                    if stats['samples'] or stats['failures']
+                ],
+            }
+        return result
+
+
+def split_list(items: List[Any], groups: int) -> List[List[Any]]:
+    """将列表尽量均匀地拆成 groups 组"""
+    groups = max(1, min(groups, len(items)))
+    size, extra = divmod(len(items), groups)
+    result, start = [], 0
+    for i in range(groups):
+        end = start + size + (1 if i < extra else 0)
+        result.append(items[start:end])
+        start = end
+    return result
+
+
+def split_bands(spatial_range: List[float], tiles: int) -> List[List[float]]:
+    """将 [lon_min, lon_max, lat_min, lat_max] 按纬度拆成 tiles 个条带"""
+    lon_min, lon_max, lat_min, lat_max = spatial_range
+    step = (lat_max - lat_min) / tiles
+    return [[lon_min, lon_max, lat_min + i * step,
+             lat_max if i == tiles - 1 else lat_min + (i + 1) * step]
+            for i in range(tiles)]
@@ -2,14 +2,27 @@
 基础下载器抽象类
 """
 import os
+import time
+import uuid
 import logging
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple
+
+from downloaders.adaptive import AdaptiveTuner, split_bands, split_list
+from downloaders.task_queue import DEFAULT_LEASE_SECONDS, LeaseHeartbeat, TaskQueue
+from utils.profiling import Profiler
+from utils.reference_index import index_downloaded_file, reference_options
+from utils.events import event_log
+from utils.catalog import MetadataCatalog, catalog_options, validate_request
 
 class BaseDownloader(ABC):
     """所有下载器的基类"""
 
+    service_name = "base"
+
     def __init__(self, config: Dict[str, Any], logger_name: str = "BaseDownloader"):
         """
         初始化下载器
@@ -29,6 +42,51 @@ class BaseDownloader(ABC):
         self.max_retries = config.get('max_retries') or general_cfg.get('max_retries', 3)
         self.timeout = config.get('timeout') or general_cfg.get('timeout', 300)
 
+        # 任务队列：默认持久化到输出目录，重启后按优先级继续
+        queue_cfg = general_cfg.get('task_queue') or {}
+        self.task_order = queue_cfg.get('order', 'chronological')
+        self.queue_poll_interval = queue_cfg.get('poll_interval', 5)
+        self.queue_path: Optional[Path] = None
+        if queue_cfg.get('persist', True):
+            self.queue_path = Path(queue_cfg.get('path') or self.output_dir / '.task_queue.db')
+        self._task_queue: Optional[TaskQueue] = None
+
+        # 出队租约：中断遗留的任务在租约过期后回收；分布式模式可单独配置
+        self.lease_seconds: float = float(queue_cfg.get('lease_seconds', DEFAULT_LEASE_SECONDS))
+        self.heartbeat_interval: Optional[float] = None
+        # 分布式模式：多台机器共享输出目录下的队列
+        distributed_cfg = general_cfg.get('distributed') or {}
+        if distributed_cfg.get('enabled'):
+            self.enable_distributed(distributed_cfg.get('queue_path'),
+                                    distributed_cfg.get('lease_seconds', 600),
+                                    distributed_cfg.get('heartbeat_interval'))
+
+        # 自适应请求粒度：按耗时/字节数/失败情况合并天数、拆分变量与空间范围
+        self.tuner: Optional[AdaptiveTuner] = None
+        adaptive_cfg = general_cfg.get('adaptive') or {}
+        if adaptive_cfg.get('enabled'):
+            self.enable_adaptive(**{key: value for key, value in adaptive_cfg.items()
+                                    if key != 'enabled'})
+
+        # 下载完成后登记到引用索引
+        self.reference_index = bool(reference_options(config).get('enabled'))
+        # 完成事件流：下游跟随事件日志而不是轮询输出目录
+        self.events = event_log(config)
+        # 元数据目录：缓存各数据集的变量/网格/时间轴，用于启动时校验请求
+        self.catalog_options = catalog_options(config)
+        self._catalog: Optional[MetadataCatalog] = None
+
+        # 性能剖析：配置开启或由调用方通过 enable_profiling/set_profiler 挂载
+        self.profiler: Optional[Profiler] = None
+        profiling_cfg = general_cfg.get('profiling') or {}
+        if profiling_cfg.get('enabled'):
+            self.enable_profiling(profiling_cfg.get('output_dir', './profile'),
+                                  use_cprofile=profiling_cfg.get('cprofile', True),
+                                  use_tracemalloc=profiling_cfg.get('tracemalloc', True),
+                                  top_n=profiling_cfg.get('top_n', 20),
+                                  memory_phases=profiling_cfg.get('memory_phases'),
+                                  memory_every=profiling_cfg.get('memory_every', 10))
+
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
     @abstractmethod
@@ -48,6 +106,405 @@ class BaseDownloader(ABC):
         """带重试机制的下载"""
         return self.download_single(params, output_path)
 
+    def enable_distributed(self, queue_path: Optional[str] = None,
+                           lease_seconds: float = 600,
+                           heartbeat_interval: Optional[float] = None) -> None:
+        """开启分布式模式，队列文件须位于各节点共享的文件系统上"""
+        self.queue_path = Path(queue_path or self.output_dir / '.task_queue.db')
+        self.lease_seconds = float(lease_seconds)
+        self.heartbeat_interval = heartbeat_interval
+        self._task_queue = None
+
+    def enable_adaptive(self, **limits) -> AdaptiveTuner:
+        """开启自适应请求粒度，limits 覆盖 downloaders.adaptive.DEFAULT_LIMITS"""
+        self.tuner = AdaptiveTuner(limits)
+        return self.tuner
+
+    def enable_profiling(self, output_dir: str = './profile', **kwargs) -> Profiler:
+        """开启分阶段剖析，返回剖析器；结束后调用 profiler.write_report() 输出结果"""
+        self.profiler = Profiler(Path(output_dir), **kwargs)
+        return self.profiler
+
+    def set_profiler(self, profiler: Optional[Profiler]) -> None:
+        """挂载外部剖析器（如命令行工具中同时剖析配置加载）"""
+        self.profiler = profiler
+
+    def profile_phase(self, name: str):
+        """剖析阶段上下文；未开启剖析时为空操作"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(name)
+
+    @property
+    def task_queue(self) -> TaskQueue:
+        if self._task_queue is None:
+            self._task_queue = TaskQueue(self.queue_path, lease_seconds=self.lease_seconds)
+        return self._task_queue
+
+    @property
+    def catalog(self) -> MetadataCatalog:
+        if self._catalog is None:
+            options = self.catalog_options
+            self._catalog = MetadataCatalog(Path(options['path']), options['ttl_hours'],
+                                            options['offline'])
+        return self._catalog
+
+    @abstractmethod
+    def fetch_metadata(self, dataset_cfg: Dict[str, Any]) -> Dict[str, Any]:
+        """从服务端拉取数据集元数据"""
+        pass
+
+    def catalog_id(self, dataset_cfg: Dict[str, Any]) -> Optional[str]:
+        """数据集在服务端目录中的标识"""
+        return dataset_cfg.get('dataset_id') or dataset_cfg.get('name')
+
+    def dataset_metadata(self, dataset_name: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """配置中数据集的元数据（优先读取本地目录缓存）"""
+        dataset_cfg = self._dataset_cfg(dataset_name)
+        dataset_id = self.catalog_id(dataset_cfg)
+        if not dataset_id:
+            return None
+        return self.catalog.get(self.service_name, dataset_id,
+                                lambda: self.fetch_metadata(dataset_cfg), refresh=refresh)
+
+    def validate_tasks(self, tasks: List[Dict[str, Any]]) -> None:
+        """按元数据目录校验各数据集的变量、空间/深度范围与时间范围"""
+        mode = self.catalog_options.get('validate', 'warn')
+        if mode == 'off' or not tasks:
+            return
+        by_dataset: Dict[str, List[Dict[str, Any]]] = {}
+        for task in tasks:
+            by_dataset.setdefault(task['params']['dataset_name'], []).append(task)
+
+        for dataset_name, items in by_dataset.items():
+            metadata = self.dataset_metadata(dataset_name)
+            if metadata is None:
+                continue
+            params = items[0]['params']
+            dataset_cfg = self._dataset_cfg(dataset_name)
+            dates = [task['date'] for task in items]
+            problems = validate_request(
+                metadata,
+                variables=params.get('variables') or dataset_cfg.get('variables'),
+                spatial_range=params.get('spatial_range') or dataset_cfg.get('spatial_range'),
+                depth_range=params.get('depth_range') or dataset_cfg.get('depth_range'),
+                start=min(dates), end=max(dates))
+            if not problems:
+                continue
+            message = f"数据集 {dataset_name} 配置校验未通过: " + "; ".join(problems)
+            if mode == 'error':
+                raise ValueError(message)
+            self.logger.warning(message)
+
+    def _known_datasets(self) -> List[str]:
+        return list(getattr(self, 'service_config', {}).get('datasets', {}).keys())
+
+    def execute_task(self, task: Dict[str, Any]) -> Optional[bool]:
+        """执行单个任务，子类可覆盖；返回 None 表示结果延后"""
+        return self.download_with_retry(task['params'], task['output_path'])
+
+    @abstractmethod
+    def task_window(self, params: Dict[str, Any]) -> Tuple[datetime, datetime]:
+        """任务覆盖的时间范围 [start, end)，用于拆分合并请求的结果"""
+        pass
+
+    def merge_task_params(self, params_list: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """将多个任务的参数合并为一个请求，不能合并时返回 None"""
+        return None
+
+    def _dataset_cfg(self, dataset_name: str) -> Dict[str, Any]:
+        return getattr(self, 'service_config', {}).get('datasets', {}).get(dataset_name, {})
+
+    def _run_batch(self, queue: TaskQueue, first: Dict[str, Any]) -> Dict[str, Optional[bool]]:
+        """按当前粒度领取并下载一批任务，返回 None 的任务已放回队列"""
+        dataset = first['dataset']
+        dataset_cfg = self._dataset_cfg(dataset)
+        variables = first['params'].get('variables') or dataset_cfg.get('variables') or []
+        spatial_range = first['params'].get('spatial_range') or dataset_cfg.get('spatial_range')
+        self.tuner.ensure(dataset, len(variables), bool(spatial_range), dataset_cfg.get('adaptive'))
+        level = self.tuner.current(dataset)
+        tasks = [first] + queue.claim_more(first, level['days'] - 1)
+
+        results: Dict[str, Optional[bool]] = {}
+        todo = []
+        for task in tasks:
+            if self.check_existing(task['output_path']):
+                # 与逐个下载一致：已存在的文件不再后处理（不重复发布事件、登记索引）
+                queue.complete(task['output_path'], True)
+                results[str(task['output_path'])] = True
+            else:
+                todo.append(task)
+        if not todo:
+            return results
+
+        self.logger.info(f"正在下载 {todo[0]['key']} 起 {len(todo)} 个任务 "
+                         f"(天数 {level['days']}, 变量分组 {level['var_groups']}, "
+                         f"空间分块 {level['tiles']})...")
+        with self.profile_phase('download'):
+            downloaded = self.download_batch(todo, level)
+
+        for path, success in downloaded.items():
+            if success is None:
+                queue.release(Path(path))
+            else:
+                if success:
+                    with self.profile_phase('postprocess'):
+                        success = self.postprocess(Path(path))
+                queue.complete(Path(path), success)
+            results[path] = success
+        return results
+
+    def download_batch(self, tasks: List[Dict[str, Any]],
+                       level: Dict[str, int]) -> Dict[str, Optional[bool]]:
+        """按粒度下载一批任务：可合并的相邻任务合成一个请求，再按变量组/纬度条带拆分请求"""
+        ordered = sorted(tasks, key=lambda task: self.task_window(task['params'])[0])
+        groups: List[List[Dict[str, Any]]] = []
+        for task in ordered:
+            if groups and self.merge_task_params(
+                    [item['params'] for item in groups[-1] + [task]]) is not None:
+                groups[-1].append(task)
+            else:
+                groups.append([task])
+
+        results: Dict[str, Optional[bool]] = {}
+        for group in groups:
+            results.update(self._download_group(group, level))
+        return results
+
+    def _download_group(self, group: List[Dict[str, Any]],
+                        level: Dict[str, int]) -> Dict[str, Optional[bool]]:
+        from utils.nc_split import combine_parts, split_by_time
+
+        dataset = group[0]['dataset']
+        dataset_cfg = self._dataset_cfg(dataset)
+        params = (group[0]['params'] if len(group) == 1
+                  else self.merge_task_params([task['params'] for task in group]))
+        variables = list(params.get('variables') or dataset_cfg.get('variables') or [])
+        spatial_range = params.get('spatial_range') or dataset_cfg.get('spatial_range')
+        var_groups = (split_list(variables, level['var_groups'])
+                      if level['var_groups'] > 1 and variables else [None])
+        bands = (split_bands(spatial_range, level['tiles'])
+                 if level['tiles'] > 1 and spatial_range else [None])
+        # 单个任务且不拆分时直接写入归档文件
+        direct = len(group) == 1 and len(var_groups) == 1 and len(bands) == 1
+
+        work_dir = self.output_dir / '.batch'
+        work_dir.mkdir(exist_ok=True)
+        parts: List[List[Path]] = []
+        success = True
+        started = time.perf_counter()
+        for var_index, group_vars in enumerate(var_groups):
+            band_paths = []
+            for band_index, band in enumerate(bands):
+                part_params = dict(params)
+                if group_vars is not None:
+                    part_params['variables'] = group_vars
+                if band is not None:
+                    part_params['spatial_range'] = band
+                if direct:
+                    part_path = group[0]['output_path']
+                else:
+                    part_path = work_dir / (f"{group[0]['output_path'].stem}_{len(group)}d"
+                                            f"_v{var_index}_t{band_index}.nc")
+                    if part_path.exists():
+                        part_path.unlink()
+                success = self.download_with_retry(part_params, part_path)
+                if not success:
+                    break
+                band_paths.append(part_path)
+            parts.append(band_paths)
+            if not success:
+                break
+        latency = time.perf_counter() - started
+        nbytes = sum(path.stat().st_size for paths in parts for path in paths if path.exists())
+        self.tuner.record(dataset, level, len(group), nbytes, latency, success)
+
+        paths = [str(task['output_path']) for task in group]
+        if direct:
+            results: Dict[str, Optional[bool]] = {paths[0]: success}
+        elif success:
+            with self.profile_phase('split'):
+                sources: List[Any] = []
+                try:
+                    ds, sources = combine_parts(parts)
+                    windows = [(*self.task_window(task['params']), task['output_path'])
+                               for task in group]
+                    results = split_by_time(ds, windows)
+                except Exception as e:
+                    self.logger.error(f"拆分批量结果失败: {e}")
+                    results = {path: False for path in paths}
+                finally:
+                    for source in sources:
+                        source.close()
+        else:
+            results = {path: False for path in paths}
+
+        if not direct:
+            for part_path in (path for band_paths in parts for path in band_paths):
+                if part_path.exists():
+                    part_path.unlink()
+
+        # 更小的粒度仍可尝试时，失败的任务放回队列重试
+        if not success and not self.tuner.is_smallest(dataset, level):
+            results = {path: None for path in results}
+        return results
+
+    def postprocess(self, output_path: Path) -> bool:
+        """单个文件下载并验证后的后处理：登记引用索引、发布完成事件
+
+        子类覆盖时应在自身处理完成后调用 super().postprocess()，保证事件发布在最后。
+        """
+        if self.reference_index:
+            try:
+                index_downloaded_file(self.config, output_path)
+            except Exception as e:
+                # 引用索引可随时用 build_references.py 重建，不影响下载结果
+                self.logger.warning(f"引用索引登记失败 {output_path}: {e}")
+        if self.events is not None:
+            try:
+                with self.profile_phase('publish'):
+                    self.events.publish_file(output_path, self.service_name)
+            except OSError as e:
+                self.logger.warning(f"完成事件发布失败 {output_path}: {e}")
+        return True
+
+    def poll_tasks(self) -> Dict[str, bool]:
+        """返回已完成的延后任务 {output_path: 结果}，每次出队前调用，不阻塞"""
+        return {}
+
+    def finalize_tasks(self) -> Dict[str, bool]:
+        """队列处理结束后的收尾，返回 {output_path: 结果} 以修正任务状态"""
+        return {}
+
+    def _complete_deferred(self, queue: TaskQueue, results: Dict[str, bool],
+                           executed: Dict[str, bool]) -> None:
+        """对延后完成的任务执行后处理并记录结果"""
+        for path, success in results.items():
+            if success:
+                with self.profile_phase('postprocess'):
+                    success = self.postprocess(Path(path))
+            queue.complete(Path(path), success)
+            executed[path] = success
+
+    def run_tasks(self, tasks: List[Dict[str, Any]], priority: int = 0,
+                  order: Optional[str] = None) -> Dict[str, bool]:
+        """将计划好的任务放入队列并处理，返回 {任务键: 是否成功}
+
+        每个任务包含 key、date、output_path、params。已存在的文件直接跳过；
+        处理过程中也会执行队列中其他作业的更高优先级任务。
+        """
+        results: Dict[str, bool] = {}
+        todo = []
+        # 出队只领取配置中存在的数据集，未知数据集的任务入队后永远不会被执行
+        known = set(self._known_datasets())
+        if known:
+            unknown = {task['params']['dataset_name'] for task in tasks} - known
+            for name in sorted(unknown):
+                self.logger.error(f"配置中没有数据集 {name}，相关任务标记为失败")
+            for task in tasks:
+                if task['params']['dataset_name'] in unknown:
+                    results[task['key']] = False
+            tasks = [task for task in tasks if task['params']['dataset_name'] not in unknown]
+
+        with self.profile_phase('validate_config'):
+            self.validate_tasks(tasks)
+        with self.profile_phase('check_existing'):
+            for task in tasks:
+                if self.check_existing(task['output_path']):
+                    self.logger.info(f"⏭️ 文件已存在，跳过: {task['output_path']}")
+                    results[task['key']] = True
+                else:
+                    todo.append(task)
+
+        if not todo:
+            return results
+
+        with self.profile_phase('enqueue'):
+            own_paths = self.task_queue.enqueue(
+                self.service_name, todo, priority=priority,
+                order=order or self.task_order, job_id=uuid.uuid4().hex)
+        key_of = {str(task['output_path']): task['key'] for task in todo}
+
+        self.process_queue(own_paths)
+
+        statuses = self.task_queue.statuses(own_paths)
+        for path in own_paths:
+            results[key_of[path]] = statuses.get(path) == 'done'
+        return results
+
+    def process_queue(self, wait_for: Optional[List[str]] = None) -> Dict[str, bool]:
+        """按优先级处理队列中本服务的任务，直至 wait_for 中的任务全部结束"""
+        with LeaseHeartbeat(self.task_queue, self.heartbeat_interval):
+            try:
+                return self._process_queue(wait_for)
+            except BaseException:
+                # 执行被中断（如 KeyboardInterrupt）时放回已领取的任务，
+                # 否则它们停留在执行中状态，后续调用会一直等待
+                self.task_queue.release_held()
+                raise
+
+    def _process_queue(self, wait_for: Optional[List[str]]) -> Dict[str, bool]:
+        queue = self.task_queue
+        queue.reset_stale()
+        executed: Dict[str, bool] = {}
+        datasets = self._known_datasets()
+        total = len(wait_for) if wait_for else queue.pending_count(self.service_name)
+
+        while True:
+            # 后台已完成的任务（如 GRIB 转换）及时回填状态，不必等到队列清空
+            self._complete_deferred(queue, self.poll_tasks(), executed)
+
+            # 有 wait_for 时，只在本作业仍有待处理任务时继续出队，避免替其他作业做完全部回填
+            own_pending = True
+            if wait_for:
+                own = queue.statuses(wait_for).values()
+                own_pending = any(status == 'pending' for status in own)
+
+            with self.profile_phase('claim'):
+                task = queue.claim_next(self.service_name, datasets) if own_pending else None
+            if task is not None and self.tuner is not None:
+                for path, success in self._run_batch(queue, task).items():
+                    if success is not None:
+                        executed[path] = success
+                self.log_progress(len(executed), max(total, len(executed)), "进度:")
+                continue
+            if task is not None:
+                output_path = task['output_path']
+                if self.check_existing(output_path):
+                    success = True
+                else:
+                    self.logger.info(f"正在下载 {task['key']} 数据 (优先级 {task['priority']})...")
+                    with self.profile_phase('download'):
+                        success = self.execute_task(task)
+                    if success:
+                        with self.profile_phase('postprocess'):
+                            success = self.postprocess(output_path)
+                # None 表示结果延后（如后台转换），由 poll_tasks/finalize_tasks 回填
+                if success is not None:
+                    queue.complete(output_path, success)
+                    executed[str(output_path)] = success
+                    self.log_progress(len(executed), max(total, len(executed)), "进度:")
+                continue
+
+            with self.profile_phase('finalize'):
+                finalized = self.finalize_tasks()
+            self._complete_deferred(queue, finalized, executed)
+
+            if not wait_for:
+                break
+            unfinished = [path for path, status in queue.statuses(wait_for).items()
+                          if status in ('pending', 'running')]
+            if not unfinished:
+                break
+            # 剩余任务由其他进程执行中，等待其完成或被回收
+            if queue.reset_stale() == 0:
+                time.sleep(self.queue_poll_interval)
+
+        if self.tuner is not None:
+            for dataset, info in self.tuner.summary().items():
+                self.logger.info(f"{dataset} 当前请求粒度: {info['current']}")
+        return executed
+
     def generate_output_path(self, template: str,
                              params: Dict[str, Any]) -> Path:
         """根据模板生成输出路径"""
@@ -3,12 +3,18 @@ C3S数据下载器
 """
 import cdsapi
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 from pathlib import Path
 import json
+from concurrent.futures import Future, ProcessPoolExecutor
 
+from downloaders.adaptive import AdaptiveTuner
 from downloaders.baseloader import BaseDownloader
+from utils.grib_convert import convert_grib_to_netcdf
+from utils.archive_index import parse_archive_filename
+from utils.derived import derive_file, derive_options
+from utils.catalog import fetch_cds
 import logging
 logger = logging.getLogger(__name__)
 
@@ -16,11 +22,30 @@ logger = logging.getLogger(__name__)
 class C3SDownloader(BaseDownloader):
     """C3S ERA5数据下载器"""
 
+    service_name = "c3s"
+
     def __init__(self, config: Dict[str, Any]):
+        # GRIB 模式：向 CDS 请求 GRIB，本地进程池转换为 NetCDF，与后续下载重叠。
+        # 需在基类初始化前确定，基类会按配置调用 enable_adaptive
+        grib_cfg = config.get('c3s', {}).get('grib_conversion') or {}
+        self.grib_mode = bool(grib_cfg.get('enabled', False))
+        self.grib_workers = grib_cfg.get('workers', 2)
+        self.keep_grib = bool(grib_cfg.get('keep_grib', False))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._conversions: Dict[str, Tuple[Future, Path]] = {}
+
         super().__init__(config, "C3SDownloader")
         self.service_config = config.get('c3s', {})
         self.client: Optional[cdsapi.Client] = None
 
+    def enable_adaptive(self, **limits) -> Optional[AdaptiveTuner]:
+        """GRIB 模式下不开启：GRIB 结果在后台转换，无法在下载后立即按时间拆分"""
+        if self.grib_mode:
+            logger.warning("GRIB 模式下不使用自适应请求粒度")
+            self.tuner = None
+            return None
+        return super().enable_adaptive(**limits)
+
     def connect(self) -> bool:
         """连接到C3S API"""
         try:
@@ -64,23 +89,34 @@ class C3SDownloader(BaseDownloader):
                 request_params['data_format'] = dataset_cfg['data_format']
             if 'download_format' in dataset_cfg:
                 request_params['download_format'] = dataset_cfg['download_format']
+            if params.get('data_format'):
+                request_params['data_format'] = params['data_format']
 
             # 添加可选参数
             if 'day' in params:
                 request_params['day'] = [f"{d:02d}" for d in params['day']]
 
+            # spatial_range 约定为 [lon_min, lon_max, lat_min, lat_max]，CDS area 为 [N, W, S, E]
+            spatial_range = params.get('spatial_range') or dataset_cfg.get('spatial_range')
+            if spatial_range:
+                request_params['area'] = [spatial_range[3], spatial_range[0],
+                                          spatial_range[2], spatial_range[1]]
+
             logger.info(f"下载C3S数据: {params}")
             if not self.client:
                 raise RuntimeError("C3S 客户端未初始化")
 
-            self.client.retrieve(
-                dataset_cfg['name'],
-                request_params,
-                str(output_path)
-            )
+            with self.profile_phase('sdk_call'):
+                self.client.retrieve(
+                    dataset_cfg['name'],
+                    request_params,
+                    str(output_path)
+                )
 
             # 验证文件
-            if self.check_existing(output_path):
+            with self.profile_phase('validate'):
+                valid = self.check_existing(output_path)
+            if valid:
                 logger.info(f"✅ 下载完成: {output_path}")
                 return True
             else:
@@ -92,10 +128,105 @@ class C3SDownloader(BaseDownloader):
             return False
 
 
+    def execute_task(self, task: Dict[str, Any]) -> Optional[bool]:
+        """下载一个时间片；GRIB 模式下提交本地转换后返回 None（结果延后）"""
+        params, output_path = task['params'], task['output_path']
+        if not self.grib_mode:
+            return self.download_with_retry(params, output_path)
+
+        grib_path = output_path.with_suffix('.grib')
+        # 上次运行遗留的 GRIB 可直接转换，无需重新下载；cdsapi 直接流式写入目标路径，
+        # 先下载到临时文件、成功后再改名，中断留下的半截文件不会被当作完整 GRIB
+        if not self.check_existing(grib_path):
+            part_path = grib_path.with_suffix('.grib.part')
+            grib_params = dict(params, data_format='grib')
+            if not self.download_with_retry(grib_params, part_path):
+                if part_path.exists():
+                    part_path.unlink()
+                return False
+            os.replace(part_path, grib_path)
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.grib_workers)
+        future = self._executor.submit(
+            convert_grib_to_netcdf, grib_path, output_path, self.keep_grib)
+        self._conversions[str(output_path)] = (future, output_path)
+        return None
+
+    def task_window(self, params: Dict[str, Any]) -> Tuple[datetime, datetime]:
+        """任务覆盖的时间范围：按 day 列表，或整月"""
+        year, month = params['year'], params['month']
+        if params.get('day'):
+            return (datetime(year, month, min(params['day'])),
+                    datetime(year, month, max(params['day'])) + timedelta(days=1))
+        start = datetime(year, month, 1)
+        return start, (start + timedelta(days=32)).replace(day=1)
+
+    def merge_task_params(self, params_list: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """同一年月、其余参数相同的逐日任务合并为一个 day 列表请求"""
+        first = params_list[0]
+        keys = ('dataset_name', 'year', 'month', 'time', 'variables',
+                'spatial_range', 'data_format')
+        for params in params_list:
+            if not params.get('day') or any(params.get(k) != first.get(k) for k in keys):
+                return None
+        days = sorted({day for params in params_list for day in params['day']})
+        return dict(first, day=days)
+
+    def postprocess(self, output_path: Path) -> bool:
+        """按数据集配置的 derived 列表计算派生变量"""
+        parsed = parse_archive_filename(output_path.name)
+        if not parsed:
+            return super().postprocess(output_path)
+        derived = self.service_config.get('datasets', {}).get(parsed[0], {}).get('derived')
+        if derived:
+            options = derive_options(self.config)
+            try:
+                derive_file(output_path, derived, mode=options['mode'],
+                            sidecar_dir=options['sidecar_dir'],
+                            max_memory_mb=options['max_memory_mb'],
+                            complevel=options['complevel'])
+            except Exception as e:
+                # 移走下载的文件，否则下次运行会把它当作已完成跳过，派生变量永远不会计算
+                failed_path = output_path.with_name(f"{output_path.name}.failed")
+                if output_path.exists():
+                    os.replace(output_path, failed_path)
+                logger.error(f"派生变量计算失败 {output_path}: {e}；"
+                             f"文件已移至 {failed_path}，下次运行重新下载")
+                return False
+        return super().postprocess(output_path)
+
+    def _collect_conversions(self, wait: bool) -> Dict[str, bool]:
+        results: Dict[str, bool] = {}
+        for key, (future, output_path) in list(self._conversions.items()):
+            if not wait and not future.done():
+                continue
+            try:
+                results[key] = future.result() and self.check_existing(output_path)
+            except Exception as e:
+                logger.error(f"GRIB 转换失败 {key}: {e}")
+                results[key] = False
+            del self._conversions[key]
+        return results
+
+    def poll_tasks(self) -> Dict[str, bool]:
+        """返回已完成的 GRIB 转换结果，不等待仍在进行的转换"""
+        return self._collect_conversions(wait=False)
+
+    def finalize_tasks(self) -> Dict[str, bool]:
+        """等待所有 GRIB 转换完成并返回结果"""
+        results = self._collect_conversions(wait=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        return results
+
     def download_date_range(self, start_date: str, end_date: str,
                             dataset_name: str = "era5_hourly",
                             variables: Optional[List[str]] = None,
-                            hours: Optional[List[str]] = None) -> Dict[str, bool]:
+                            hours: Optional[List[str]] = None,
+                            priority: int = 0,
+                            order: Optional[str] = None) -> Dict[str, bool]:
         """按日期范围下载（支持日/小时级）"""
         results = {}
 
@@ -108,41 +239,40 @@ class C3SDownloader(BaseDownloader):
         if end_dt < start_dt:
             raise ValueError("end_date 不能早于 start_date")
 
-        total_days = (end_dt - start_dt).days + 1
-        current = 0
-
-        current_dt = start_dt
-        while current_dt <= end_dt:
-            current += 1
-            year = current_dt.year
-            month = current_dt.month
-            day = current_dt.day
-
-            output_path = self.output_dir / f"{dataset_name}_{year}{month:02d}{day:02d}.nc"
-
-            if self.check_existing(output_path):
-                logger.info(f"⏭️ 文件已存在，跳过: {output_path}")
-                results[current_dt.strftime("%Y-%m-%d")] = True
+        with self.profile_phase('plan'):
+            tasks = []
+            current_dt = start_dt
+            while current_dt <= end_dt:
+                year = current_dt.year
+                month = current_dt.month
+                day = current_dt.day
+
+                tasks.append({
+                    'key': current_dt.strftime("%Y-%m-%d"),
+                    'date': current_dt,
+                    'output_path': self.output_dir / f"{dataset_name}_{year}{month:02d}{day:02d}.nc",
+                    'params': {
+                        'dataset_name': dataset_name,
+                        'year': year,
+                        'month': month,
+                        'day': [day],
+                        'time': hours,
+                        'variables': variables
+                    }
+                })
                 current_dt += timedelta(days=1)
-                continue
 
-            params = {
-                'dataset_name': dataset_name,
-                'year': year,
-                'month': month,
-                'day': [day],
-                'time': hours,
-                'variables': variables
-            }
+        return self.run_tasks(tasks, priority=priority, order=order)
 
-            logger.info(f"正在下载 {current_dt.strftime('%Y-%m-%d')} 数据...")
-            success = self.download_with_retry(params, output_path)
-            results[current_dt.strftime("%Y-%m-%d")] = success
+    def fetch_metadata(self, dataset_cfg: Dict[str, Any]) -> Dict[str, Any]:
+        api_url = (self.service_config.get('api_url') or os.getenv('CDSAPI_URL')
+                   or 'https://cds.climate.copernicus.eu/api')
+        return fetch_cds(dataset_cfg['name'], api_url, self.catalog_options['timeout'])
 
-            logger.info(f"进度: {current}/{total_days} ({current / total_days * 100:.1f}%)")
-            current_dt += timedelta(days=1)
-
-        return results
+    def get_dataset_info(self, dataset_name: str = "era5_hourly",
+                         refresh: bool = False) -> Dict[str, Any]:
+        """获取数据集信息（变量、空间与时间范围），优先读取本地元数据目录"""
+        return self.dataset_metadata(dataset_name, refresh=refresh) or {}
 
     def list_available_datasets(self) -> Dict[str, Any]:
         """列出可用数据集"""
@@ -152,7 +282,9 @@ class C3SDownloader(BaseDownloader):
 
     def download_monthly_range(self, start_date: str, end_date: str,
                                dataset_name: str = "era5_monthly",
-                               variables: Optional[List[str]] = None) -> Dict[str, bool]:
+                               variables: Optional[List[str]] = None,
+                               priority: int = 0,
+                               order: Optional[str] = None) -> Dict[str, bool]:
         """下载月平均数据时间序列"""
         results = {}
 
@@ -163,62 +295,60 @@ class C3SDownloader(BaseDownloader):
         start_year, start_month = map(int, start_date.split('-'))
         end_year, end_month = map(int, end_date.split('-'))
 
-        total_months = (end_year - start_year) * 12 + (end_month - start_month) + 1
-        current = 0
-
-        year, month = start_year, start_month
-        while year < end_year or (year == end_year and month <= end_month):
-            current += 1
-
-            output_path = self.output_dir / f"{dataset_name}_{year}_{month:02d}.nc"
-
-            if self.check_existing(output_path):
-                logger.info(f"⏭️ 文件已存在，跳过: {output_path}")
-                results[f"{year}-{month:02d}"] = True
-            else:
-                params = {
-                    'dataset_name': dataset_name,
-                    'year': year,
-                    'month': month,
-                    'variables': variables
-                }
-
-                logger.info(f"正在下载 {year}-{month:02d} 数据...")
-                success = self.download_with_retry(params, output_path)
-                results[f"{year}-{month:02d}"] = success
-
-            if month == 12:
-                year += 1
-                month = 1
-            else:
-                month += 1
-
-            logger.info(f"进度: {current}/{total_months} ({current / total_months * 100:.1f}%)")
-
-        return results
+        with self.profile_phase('plan'):
+            tasks = []
+            year, month = start_year, start_month
+            while year < end_year or (year == end_year and month <= end_month):
+                tasks.append({
+                    'key': f"{year}-{month:02d}",
+                    'date': datetime(year, month, 1),
+                    'output_path': self.output_dir / f"{dataset_name}_{year}_{month:02d}.nc",
+                    'params': {
+                        'dataset_name': dataset_name,
+                        'year': year,
+                        'month': month,
+                        'variables': variables
+                    }
+                })
+
+                if month == 12:
+                    year += 1
+                    month = 1
+                else:
+                    month += 1
+
+        return self.run_tasks(tasks, priority=priority, order=order)
 
     def download_daily_range(self, start_date: str, end_date: str,
                              dataset_name: str = "era5_daily",
                              variables: Optional[List[str]] = None,
-                             hours: Optional[List[str]] = None) -> Dict[str, bool]:
+                             hours: Optional[List[str]] = None,
+                             priority: int = 0,
+                             order: Optional[str] = None) -> Dict[str, bool]:
         """按日期范围下载（日平均）"""
         return self.download_date_range(
             start_date=start_date,
             end_date=end_date,
             dataset_name=dataset_name,
             variables=variables,
-            hours=hours
+            hours=hours,
+            priority=priority,
+            order=order
         )
 
     def download_hourly_range(self, start_date: str, end_date: str,
                               dataset_name: str = "era5_hourly",
                               variables: Optional[List[str]] = None,
-                              hours: Optional[List[str]] = None) -> Dict[str, bool]:
+                              hours: Optional[List[str]] = None,
+                              priority: int = 0,
+                              order: Optional[str] = None) -> Dict[str, bool]:
         """按日期范围下载（小时级）"""
         return self.download_date_range(
             start_date=start_date,
             end_date=end_date,
             dataset_name=dataset_name,
             variables=variables,
-            hours=hours
+            hours=hours,
+            priority=priority,
+            order=order
         )
\ No newline at end of file
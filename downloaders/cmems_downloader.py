@@ -1,13 +1,14 @@
 """
 CMEMS数据下载器（工程化版本）
 """
-from copernicusmarine import subset, get
-from typing import Dict, Any, List, Optional
+from copernicusmarine import subset
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 from datetime import datetime, timedelta
 import os
 
 from downloaders.baseloader import BaseDownloader
+from utils.catalog import fetch_cmems
 import logging
 logger = logging.getLogger(__name__)
 
@@ -15,6 +16,8 @@ logger = logging.getLogger(__name__)
 class CMEMSDownloader(BaseDownloader):
     """CMEMS海洋数据下载器"""
 
+    service_name = "cmems"
+
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config, "CMEMSDownloader")
         self.service_config = config.get('cmems', {})
@@ -37,6 +40,9 @@ class CMEMSDownloader(BaseDownloader):
         """下载单个月份数据"""
         try:
             dataset_cfg = self.service_config['datasets'][params['dataset_name']]
+            # 调用方可覆盖空间/深度范围（如本地子集查询的缺口回补）
+            spatial_range = params.get('spatial_range') or dataset_cfg['spatial_range']
+            depth_range = params.get('depth_range') or dataset_cfg['depth_range']
 
             # 构建下载参数
             download_params = {
@@ -44,12 +50,12 @@ class CMEMSDownloader(BaseDownloader):
                 "variables": params.get('variables') or dataset_cfg['variables'],
                 "start_datetime": params['start_datetime'],
                 "end_datetime": params['end_datetime'],
-                "minimum_longitude": dataset_cfg['spatial_range'][0],
-                "maximum_longitude": dataset_cfg['spatial_range'][1],
-                "minimum_latitude": dataset_cfg['spatial_range'][2],
-                "maximum_latitude": dataset_cfg['spatial_range'][3],
-                "minimum_depth": dataset_cfg['depth_range'][0],
-                "maximum_depth": dataset_cfg['depth_range'][1],
+                "minimum_longitude": spatial_range[0],
+                "maximum_longitude": spatial_range[1],
+                "minimum_latitude": spatial_range[2],
+                "maximum_latitude": spatial_range[3],
+                "minimum_depth": depth_range[0],
+                "maximum_depth": depth_range[1],
                 "output_filename": str(output_path),
                 "force_download": params.get('force_download', False)
             }
@@ -57,10 +63,13 @@ class CMEMSDownloader(BaseDownloader):
             logger.info(f"下载CMEMS数据: {params['start_datetime'].strftime('%Y-%m')}")
 
             # 使用copernicusmarine库下载
-            subset(**download_params)
+            with self.profile_phase('sdk_call'):
+                subset(**download_params)
 
             # 验证文件
-            if self.check_existing(output_path):
+            with self.profile_phase('validate'):
+                valid = self.check_existing(output_path)
+            if valid:
                 logger.info(f"✅ 下载完成: {output_path}")
                 return True
             else:
@@ -71,9 +80,26 @@ class CMEMSDownloader(BaseDownloader):
             logger.error(f"下载失败: {e}")
             return False
 
+    def task_window(self, params: Dict[str, Any]) -> Tuple[datetime, datetime]:
+        # subset 的 end_datetime 是闭区间，拆分合并请求时保持与单独请求相同的内容
+        return params['start_datetime'], params['end_datetime'] + timedelta(microseconds=1)
+
+    def merge_task_params(self, params_list: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """时间上首尾相接、其余参数相同的任务合并为一个时间范围请求"""
+        first = params_list[0]
+        keys = ('dataset_name', 'variables', 'spatial_range', 'depth_range')
+        for prev, params in zip(params_list, params_list[1:]):
+            if params['start_datetime'] != prev['end_datetime']:
+                return None
+            if any(params.get(k) != first.get(k) for k in keys):
+                return None
+        return dict(first, end_datetime=params_list[-1]['end_datetime'])
+
     def download_monthly_range(self, start_date: str, end_date: str,
                                dataset_name: str = "glo12_monthly",
-                               variables: Optional[List[str]] = None) -> Dict[str, bool]:
+                               variables: Optional[List[str]] = None,
+                               priority: int = 0,
+                               order: Optional[str] = None) -> Dict[str, bool]:
         """下载月平均数据时间序列"""
         results = {}
 
@@ -85,57 +111,44 @@ class CMEMSDownloader(BaseDownloader):
         start_year, start_month = map(int, start_date.split('-'))
         end_year, end_month = map(int, end_date.split('-'))
 
-        # 计算总月数
-        total_months = (end_year - start_year) * 12 + (end_month - start_month) + 1
-        current = 0
-
-        year, month = start_year, start_month
-        while year < end_year or (year == end_year and month <= end_month):
-            current += 1
-
-            # 生成时间范围
-            start_dt = datetime(year, month, 1)
-            if month == 12:
-                end_dt = datetime(year + 1, 1, 1)
-            else:
-                end_dt = datetime(year, month + 1, 1)
-
-            # 生成输出路径
-            output_path = self.output_dir / f"{dataset_name}_{year}_{month:02d}.nc"
-
-            # 检查是否已存在
-            if self.check_existing(output_path):
-                logger.info(f"⏭️ 文件已存在，跳过: {output_path}")
-                results[f"{year}-{month:02d}"] = True
-            else:
-                # 下载参数
-                params = {
-                    'dataset_name': dataset_name,
-                    'start_datetime': start_dt,
-                    'end_datetime': end_dt,
-                    'variables': variables,
-                    'force_download': False
-                }
-
-                logger.info(f"正在下载 {year}-{month:02d} 数据...")
-                success = self.download_with_retry(params, output_path)
-                results[f"{year}-{month:02d}"] = success
-
-            # 更新月份
-            if month == 12:
-                year += 1
-                month = 1
-            else:
-                month += 1
-
-            # 记录进度
-            logger.info(f"进度: {current}/{total_months} ({current / total_months * 100:.1f}%)")
-
-        return results
+        with self.profile_phase('plan'):
+            tasks = []
+            year, month = start_year, start_month
+            while year < end_year or (year == end_year and month <= end_month):
+                # 生成时间范围
+                start_dt = datetime(year, month, 1)
+                if month == 12:
+                    end_dt = datetime(year + 1, 1, 1)
+                else:
+                    end_dt = datetime(year, month + 1, 1)
+
+                tasks.append({
+                    'key': f"{year}-{month:02d}",
+                    'date': start_dt,
+                    'output_path': self.output_dir / f"{dataset_name}_{year}_{month:02d}.nc",
+                    'params': {
+                        'dataset_name': dataset_name,
+                        'start_datetime': start_dt,
+                        'end_datetime': end_dt,
+                        'variables': variables,
+                        'force_download': False
+                    }
+                })
+
+                # 更新月份
+                if month == 12:
+                    year += 1
+                    month = 1
+                else:
+                    month += 1
+
+        return self.run_tasks(tasks, priority=priority, order=order)
 
     def download_daily_range(self, start_date: str, end_date: str,
                              dataset_name: str,
-                             variables: Optional[List[str]] = None) -> Dict[str, bool]:
+                             variables: Optional[List[str]] = None,
+                             priority: int = 0,
+                             order: Optional[str] = None) -> Dict[str, bool]:
         """下载日平均数据时间序列"""
         results = {}
 
@@ -148,44 +161,35 @@ class CMEMSDownloader(BaseDownloader):
         if end_dt < start_dt:
             raise ValueError("end_date 不能早于 start_date")
 
-        total_days = (end_dt - start_dt).days + 1
-        current = 0
-
-        current_dt = start_dt
-        while current_dt <= end_dt:
-            current += 1
-            day_start = datetime(current_dt.year, current_dt.month, current_dt.day)
-            day_end = day_start + timedelta(days=1)
-
-            output_path = self.output_dir / f"{dataset_name}_{current_dt.strftime('%Y%m%d')}.nc"
-
-            if self.check_existing(output_path):
-                logger.info(f"⏭️ 文件已存在，跳过: {output_path}")
-                results[current_dt.strftime("%Y-%m-%d")] = True
+        with self.profile_phase('plan'):
+            tasks = []
+            current_dt = start_dt
+            while current_dt <= end_dt:
+                day_start = datetime(current_dt.year, current_dt.month, current_dt.day)
+                day_end = day_start + timedelta(days=1)
+
+                tasks.append({
+                    'key': current_dt.strftime("%Y-%m-%d"),
+                    'date': day_start,
+                    'output_path': self.output_dir / f"{dataset_name}_{current_dt.strftime('%Y%m%d')}.nc",
+                    'params': {
+                        'dataset_name': dataset_name,
+                        'start_datetime': day_start,
+                        'end_datetime': day_end,
+                        'variables': variables,
+                        'force_download': False
+                    }
+                })
                 current_dt += timedelta(days=1)
-                continue
-
-            params = {
-                'dataset_name': dataset_name,
-                'start_datetime': day_start,
-                'end_datetime': day_end,
-                'variables': variables,
-                'force_download': False
-            }
-
-            logger.info(f"正在下载 {current_dt.strftime('%Y-%m-%d')} 数据...")
-            success = self.download_with_retry(params, output_path)
-            results[current_dt.strftime("%Y-%m-%d")] = success
-
-            logger.info(f"进度: {current}/{total_days} ({current / total_days * 100:.1f}%)")
-            current_dt += timedelta(days=1)
 
-        return results
+        return self.run_tasks(tasks, priority=priority, order=order)
 
     def download_hourly_range(self, start_date: str, end_date: str,
                               dataset_name: str,
                               variables: Optional[List[str]] = None,
-                              hours: Optional[List[str]] = None) -> Dict[str, bool]:
+                              hours: Optional[List[str]] = None,
+                              priority: int = 0,
+                              order: Optional[str] = None) -> Dict[str, bool]:
         """下载小时级数据（按天分片）"""
         results = {}
 
@@ -201,56 +205,46 @@ class CMEMSDownloader(BaseDownloader):
         current_day = datetime(start_dt.year, start_dt.month, start_dt.day)
         end_day = datetime(end_dt.year, end_dt.month, end_dt.day)
 
-        total_days = (end_day - current_day).days + 1
-        current = 0
-
-        while current_day <= end_day:
-            current += 1
-            day_start = current_day
-            day_end = day_start + timedelta(days=1)
-
-            if hours:
-                hours_sorted = sorted(hours)
-                range_start = datetime.fromisoformat(f"{current_day.strftime('%Y-%m-%d')}T{hours_sorted[0]}")
-                last_hour = hours_sorted[-1]
-                range_end = datetime.fromisoformat(f"{current_day.strftime('%Y-%m-%d')}T{last_hour}") + timedelta(hours=1)
-            else:
-                range_start = day_start
-                range_end = day_end
-
-            output_path = self.output_dir / f"{dataset_name}_{current_day.strftime('%Y%m%d')}.nc"
-
-            if self.check_existing(output_path):
-                logger.info(f"⏭️ 文件已存在，跳过: {output_path}")
-                results[current_day.strftime("%Y-%m-%d")] = True
+        with self.profile_phase('plan'):
+            tasks = []
+            while current_day <= end_day:
+                day_start = current_day
+                day_end = day_start + timedelta(days=1)
+
+                if hours:
+                    hours_sorted = sorted(hours)
+                    range_start = datetime.fromisoformat(f"{current_day.strftime('%Y-%m-%d')}T{hours_sorted[0]}")
+                    last_hour = hours_sorted[-1]
+                    range_end = datetime.fromisoformat(f"{current_day.strftime('%Y-%m-%d')}T{last_hour}") + timedelta(hours=1)
+                else:
+                    range_start = day_start
+                    range_end = day_end
+
+                tasks.append({
+                    'key': current_day.strftime("%Y-%m-%d"),
+                    'date': day_start,
+                    'output_path': self.output_dir / f"{dataset_name}_{current_day.strftime('%Y%m%d')}.nc",
+                    'params': {
+                        'dataset_name': dataset_name,
+                        'start_datetime': range_start,
+                        'end_datetime': range_end,
+                        'variables': variables,
+                        'force_download': False
+                    }
+                })
                 current_day += timedelta(days=1)
-                continue
-
-            params = {
-                'dataset_name': dataset_name,
-                'start_datetime': range_start,
-                'end_datetime': range_end,
-                'variables': variables,
-                'force_download': False
-            }
 
-            logger.info(f"正在下载 {current_day.strftime('%Y-%m-%d')} 小时级数据...")
-            success = self.download_with_retry(params, output_path)
-            results[current_day.strftime("%Y-%m-%d")] = success
+        return self.run_tasks(tasks, priority=priority, order=order)
 
-            logger.info(f"进度: {current}/{total_days} ({current / total_days * 100:.1f}%)")
-            current_day += timedelta(days=1)
+    def fetch_metadata(self, dataset_cfg: Dict[str, Any]) -> Dict[str, Any]:
+        return fetch_cmems(dataset_cfg['dataset_id'])
 
-        return results
-
-    def get_dataset_info(self, dataset_id: str = None) -> Dict[str, Any]:
-        """获取数据集信息"""
+    def get_dataset_info(self, dataset_id: str = None,
+                         refresh: bool = False) -> Dict[str, Any]:
+        """获取数据集信息（变量、经纬度/深度范围与时间轴），优先读取本地元数据目录"""
         if not dataset_id:
             dataset_id = self.service_config['datasets']['glo12_monthly']['dataset_id']
 
-        try:
-            # 使用copernicusmarine的get函数获取数据集信息
-            return get(dataset_id)
-        except Exception as e:
-            logger.error(f"获取数据集信息失败: {e}")
-            return {}
\ No newline at end of file
+        metadata = self.catalog.get(self.service_name, dataset_id,
+                                    lambda: fetch_cmems(dataset_id), refresh=refresh)
+        return metadata or {}
\ No newline at end of file
@@ -0,0 +1,417 @@
+"""
+持久化下载任务队列：按优先级与时间顺序出队，重启后保持顺序
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ORDERS = ('chronological', 'recent_first')
+
+# 持久化队列中每个执行中任务的默认租约时长（秒）
+DEFAULT_LEASE_SECONDS = 600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    output_path TEXT PRIMARY KEY,
+    service     TEXT NOT NULL,
+    dataset     TEXT NOT NULL,
+    task_key    TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    priority    INTEGER NOT NULL DEFAULT 0,
+    sort_key    REAL NOT NULL,
+    direction   INTEGER NOT NULL DEFAULT 1,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    owner       TEXT,
+    job_id      TEXT,
+    job_created REAL NOT NULL DEFAULT 0,
+    lease_expires_at REAL,
+    updated_at  REAL NOT NULL
+);
+"""
+
+_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_tasks_claim
+    ON tasks (service, status, priority DESC, job_created);
+"""
+
+# 旧版本队列文件缺少的列；旧任务重新入队时按新规则写入排序信息
+_MIGRATIONS = {
+    'lease_expires_at': "ALTER TABLE tasks ADD COLUMN lease_expires_at REAL",
+    'direction': "ALTER TABLE tasks ADD COLUMN direction INTEGER NOT NULL DEFAULT 1",
+    'job_created': "ALTER TABLE tasks ADD COLUMN job_created REAL NOT NULL DEFAULT 0",
+}
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"无法序列化: {type(value)}")
+
+
+def _decode(obj: Dict[str, Any]) -> Any:
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+def encode_params(params: Dict[str, Any]) -> str:
+    return json.dumps(params, default=_encode, sort_keys=True)
+
+
+def decode_params(text: str) -> Dict[str, Any]:
+    return json.loads(text, object_hook=_decode)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TaskQueue:
+    """基于 SQLite 的下载任务队列
+
+    出队顺序：priority 降序；同优先级按作业入队先后；同一作业内按任务时间戳，
+    chronological 升序、recent_first 降序（direction 为 1/-1）。顺序只在作业内生效，
+    后入队的 recent_first 作业不会越过先入队的回填作业。多个进程可共享同一队列：
+    紧急任务以更高优先级入队后，正在回填的进程会在下一次出队时优先处理它。
+
+    持久化队列出队即获得有期限的租约，执行期间由 LeaseHeartbeat 只为本实例仍持有
+    的任务续租；进程中断或节点宕机后租约过期，任务被任意进程回收，等待中的调用
+    不会无限阻塞。本实例领取后未完成也未放回的任务（如调用被 KeyboardInterrupt
+    打断）在下一次 reset_stale 时立即回收。
+
+    队列文件默认位于输出目录，该目录可能挂载在多台机器共享的 NFS/Lustre 上（即使
+    未开启分布式模式也可能有多台机器同时运行），共享文件系统不支持 WAL 所需的
+    共享内存，因此始终使用 DELETE 日志模式，依靠文件锁互斥。
+    """
+
+    def __init__(self, db_path: Optional[Path] = None,
+                 lease_seconds: Optional[float] = DEFAULT_LEASE_SECONDS):
+        self.db_path = str(db_path) if db_path else ':memory:'
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # 内存队列只有本进程可见，不需要租约
+        self.lease_seconds = (lease_seconds or DEFAULT_LEASE_SECONDS) if db_path else None
+        # 随机后缀区分同一进程内的多个队列实例以及复用 pid 的新进程
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # 本实例领取后尚未完成或放回的任务
+        self._held: set = set()
+        self._held_lock = threading.Lock()
+        self.conn = self.connect()
+        if db_path:
+            # 旧版本队列文件可能处于 WAL 模式，这里切换回 DELETE
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(_SCHEMA)
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+        for column, statement in _MIGRATIONS.items():
+            if column not in columns:
+                self.conn.execute(statement)
+        if 'job_created' not in columns:
+            # 旧索引按 sort_key 排序，改为按作业
+            self.conn.execute("DROP INDEX IF EXISTS idx_tasks_claim")
+        self.conn.executescript(_INDEX)
+
+    def connect(self) -> sqlite3.Connection:
+        """新建到队列文件的连接（每个线程需使用各自的连接）"""
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def enqueue(self, service: str, tasks: Iterable[Dict[str, Any]],
+                priority: int = 0, order: str = 'chronological',
+                job_id: Optional[str] = None) -> List[str]:
+        """批量入队，返回任务的 output_path 列表
+
+        同一 output_path 重复入队时保留较高优先级，失败/已完成的任务重新置为待处理，
+        正在执行的任务不受影响。
+        """
+        if order not in ORDERS:
+            raise ValueError(f"不支持的任务顺序: {order}")
+
+        now = time.time()
+        direction = -1 if order == 'recent_first' else 1
+        job_id = job_id or f"{self.owner}:{now}"
+        rows = []
+        for task in tasks:
+            rows.append((
+                str(task['output_path']), service, task['params']['dataset_name'],
+                task['key'], encode_params(task['params']), priority,
+                task['date'].timestamp(), direction, job_id, now, now,
+            ))
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("""
+                INSERT INTO tasks (output_path, service, dataset, task_key, params,
+                                   priority, sort_key, direction, job_id, job_created,
+                                   updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(output_path) DO UPDATE SET
+                    params = excluded.params,
+                    priority = MAX(tasks.priority, excluded.priority),
+                    sort_key = excluded.sort_key,
+                    direction = excluded.direction,
+                    job_id = excluded.job_id,
+                    job_created = excluded.job_created,
+                    status = CASE WHEN tasks.status = 'running'
+                                  THEN tasks.status ELSE 'pending' END,
+                    updated_at = CASE WHEN tasks.status = 'running'
+                                      THEN tasks.updated_at ELSE excluded.updated_at END
+            """, rows)
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [row[0] for row in rows]
+
+    def claim_next(self, service: str,
+                   datasets: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        """原子地取出优先级最高的待处理任务，并标记为执行中"""
+        datasets = list(datasets or [])
+        query = "SELECT * FROM tasks WHERE service = ? AND status = 'pending'"
+        args: List[Any] = [service]
+        if datasets:
+            query += f" AND dataset IN ({','.join('?' * len(datasets))})"
+            args.extend(datasets)
+        query += " ORDER BY priority DESC, job_created, job_id, sort_key * direction LIMIT 1"
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(query, args).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            now = time.time()
+            lease = now + self.lease_seconds if self.lease_seconds else None
+            self.conn.execute("""
+                UPDATE tasks SET status = 'running', owner = ?,
+                                 lease_expires_at = ?, updated_at = ?
+                WHERE output_path = ?
+            """, (self.owner, lease, now, row['output_path']))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        self._hold([row['output_path']])
+        return self._task(row)
+
+    def _hold(self, paths: Iterable[str]) -> None:
+        with self._held_lock:
+            self._held.update(paths)
+
+    def _drop(self, path: str) -> None:
+        with self._held_lock:
+            self._held.discard(path)
+
+    def held(self) -> List[str]:
+        """本实例领取后尚未完成或放回的任务"""
+        with self._held_lock:
+            return list(self._held)
+
+    @staticmethod
+    def _task(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'key': row['task_key'],
+            'output_path': Path(row['output_path']),
+            'params': decode_params(row['params']),
+            'priority': row['priority'],
+            'service': row['service'],
+            'dataset': row['dataset'],
+            'sort_key': row['sort_key'],
+            'direction': row['direction'],
+            'job_id': row['job_id'],
+        }
+
+    def claim_more(self, task: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+        """继续领取与 task 同作业、同数据集、同优先级、顺序紧随其后的待处理任务（用于合并请求）"""
+        if count <= 0:
+            return []
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute("""
+                SELECT * FROM tasks
+                WHERE service = ? AND dataset = ? AND priority = ? AND status = 'pending'
+                      AND job_id IS ? AND sort_key * direction > ?
+                ORDER BY sort_key * direction LIMIT ?
+            """, (task['service'], task['dataset'], task['priority'], task['job_id'],
+                  task['sort_key'] * task['direction'], count)).fetchall()
+            now = time.time()
+            lease = now + self.lease_seconds if self.lease_seconds else None
+            self.conn.executemany("""
+                UPDATE tasks SET status = 'running', owner = ?,
+                                 lease_expires_at = ?, updated_at = ?
+                WHERE output_path = ?
+            """, [(self.owner, lease, now, row['output_path']) for row in rows])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self._hold(row['output_path'] for row in rows)
+        return [self._task(row) for row in rows]
+
+    def release(self, output_path: Path) -> None:
+        """放回本进程领取的任务，稍后重新出队"""
+        self.conn.execute("""
+            UPDATE tasks SET status = 'pending', owner = NULL, lease_expires_at = NULL,
+                             updated_at = ?
+            WHERE output_path = ? AND owner = ?
+        """, (time.time(), str(output_path), self.owner))
+        self._drop(str(output_path))
+
+    def release_held(self) -> int:
+        """放回本实例持有的全部任务（执行被中断时调用），返回放回数量"""
+        paths = self.held()
+        for path in paths:
+            self.release(Path(path))
+        if paths:
+            logger.warning(f"执行中断，已将 {len(paths)} 个任务放回队列")
+        return len(paths)
+
+    def complete(self, output_path: Path, success: bool) -> None:
+        """记录任务结果；租约已被其他节点接手时不覆盖其状态"""
+        cursor = self.conn.execute("""
+            UPDATE tasks SET status = ?, owner = NULL, lease_expires_at = NULL, updated_at = ?
+            WHERE output_path = ? AND (owner = ? OR owner IS NULL)
+        """, ('done' if success else 'failed', time.time(), str(output_path), self.owner))
+        self._drop(str(output_path))
+        if cursor.rowcount == 0:
+            logger.warning(f"任务租约已被其他节点接手，未更新状态: {output_path}")
+
+    def renew_leases(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """为本实例仍持有的任务续租，返回续租数量
+
+        中断后遗留的任务不在持有列表中，不再续租，租约到期后由其他进程回收。
+        """
+        paths = self.held()
+        if not self.lease_seconds or not paths:
+            return 0
+        now = time.time()
+        renewed = 0
+        for path in paths:
+            renewed += (conn or self.conn).execute("""
+                UPDATE tasks SET lease_expires_at = ?, updated_at = ?
+                WHERE output_path = ? AND owner = ? AND status = 'running'
+            """, (now + self.lease_seconds, now, path, self.owner)).rowcount
+        return renewed
+
+    def statuses(self, output_paths: Iterable[str]) -> Dict[str, str]:
+        """查询一组任务的状态"""
+        paths = list(output_paths)
+        result: Dict[str, str] = {}
+        for start in range(0, len(paths), 500):
+            batch = paths[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT output_path, status FROM tasks "
+                f"WHERE output_path IN ({','.join('?' * len(batch))})", batch)
+            result.update({row['output_path']: row['status'] for row in rows})
+        return result
+
+    def reset_stale(self) -> int:
+        """将遗留的执行中任务重置为待处理
+
+        本实例未持有的自身任务与本机已退出进程的任务立即回收；其他任务在租约
+        过期后回收。旧版本领取的任务没有租约，按最后更新时间加租约时长计算。
+        """
+        host = socket.gethostname()
+        held = set(self.held())
+        lease = self.lease_seconds or DEFAULT_LEASE_SECONDS
+        # 查询与回收在同一写事务内完成，期间其他节点无法续租或完成任务
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            rows = self.conn.execute(
+                "SELECT output_path, owner, lease_expires_at, updated_at FROM tasks "
+                "WHERE status = 'running'").fetchall()
+            dead, expired = [], []
+            for row in rows:
+                owner_host, pid = ((row['owner'] or '').split(':') + ['', ''])[:2]
+                if row['owner'] == self.owner:
+                    if row['output_path'] not in held:
+                        dead.append((row['output_path'], row['owner']))
+                elif owner_host == host and pid.isdigit() and not _pid_alive(int(pid)):
+                    dead.append((row['output_path'], row['owner']))
+                else:
+                    expires = row['lease_expires_at']
+                    if expires is None:
+                        expires = row['updated_at'] + lease
+                    if expires < now:
+                        expired.append((row['output_path'], row['owner'], lease, now))
+            reclaimed = 0
+            for row in dead:
+                reclaimed += self.conn.execute(
+                    "UPDATE tasks SET status = 'pending', owner = NULL, lease_expires_at = NULL "
+                    "WHERE output_path = ? AND owner IS ? AND status = 'running'", row).rowcount
+            # 再次检查租约，只回收仍然过期的任务
+            for row in expired:
+                reclaimed += self.conn.execute(
+                    "UPDATE tasks SET status = 'pending', owner = NULL, lease_expires_at = NULL "
+                    "WHERE output_path = ? AND owner IS ? AND status = 'running' "
+                    "AND COALESCE(lease_expires_at, updated_at + ?) < ?", row).rowcount
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        if reclaimed:
+            logger.warning(f"已回收 {reclaimed} 个中断的任务")
+        return reclaimed
+
+    def pending_count(self, service: Optional[str] = None) -> int:
+        query = "SELECT COUNT(*) FROM tasks WHERE status = 'pending'"
+        args: List[Any] = []
+        if service:
+            query += " AND service = ?"
+            args.append(service)
+        return self.conn.execute(query, args).fetchone()[0]
+
+
+class LeaseHeartbeat:
+    """后台线程定期为本进程持有的任务续租"""
+
+    def __init__(self, queue: TaskQueue, interval: Optional[float] = None):
+        self.queue = queue
+        self.interval = interval or max(1.0, (queue.lease_seconds or 0) / 3)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        conn = self.queue.connect()
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    self.queue.renew_leases(conn)
+                except sqlite3.Error as e:
+                    # 共享文件系统短暂不可用时下次重试，租约时长留有余量
+                    logger.warning(f"续租失败: {e}")
+        finally:
+            conn.close()
+
+    def __enter__(self) -> 'LeaseHeartbeat':
+        if self.queue.lease_seconds:
+            self._thread = threading.Thread(target=self._run, name='lease-heartbeat',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+归档重分块/重压缩命令行工具
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.config_manager import ConfigManager
+from utils.rechunk import rechunk_archive
+import argparse
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NetCDF归档重分块/重压缩工具')
+    parser.add_argument('--dataset', type=str, required=True,
+                        help='数据集名称')
+    parser.add_argument('--config', type=str, default='./config/config.yaml',
+                        help='配置文件路径')
+    parser.add_argument('--files', type=str, nargs='+',
+                        help='指定文件（默认处理归档中该数据集的全部文件）')
+    parser.add_argument('--compression', type=str, choices=['zlib', 'zstd', 'none'],
+                        help='压缩算法')
+    parser.add_argument('--complevel', type=int, help='压缩级别')
+    parser.add_argument('--no_shuffle', action='store_true', help='关闭 shuffle 过滤器')
+    parser.add_argument('--workers', type=int, help='并行进程数')
+    parser.add_argument('--force', action='store_true', help='布局已符合时也重写')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    config_manager = ConfigManager()
+    config = config_manager.load_config(args.config)
+
+    options = {}
+    if args.compression:
+        options['compression'] = None if args.compression == 'none' else args.compression
+    if args.complevel is not None:
+        options['complevel'] = args.complevel
+    if args.no_shuffle:
+        options['shuffle'] = False
+    if args.workers:
+        options['workers'] = args.workers
+
+    files = [Path(p) for p in args.files] if args.files else None
+    results = rechunk_archive(config, args.dataset, options, files=files, force=args.force)
+
+    success_count = sum(1 for r in results.values() if r)
+    total_count = len(results)
+
+    print(f"\n重写完成!")
+    print(f"成功: {success_count}/{total_count}")
+    print(f"失败: {total_count - success_count}/{total_count}")
+
+
+if __name__ == "__main__":
+    main()
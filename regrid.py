@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+海洋/大气数据网格配准命令行工具
+"""
+import sys
+from pathlib import Path
+from datetime import datetime
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.config_manager import ConfigManager
+from utils.regrid import colocate
+import argparse
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description='将一个数据集重插值到另一个数据集的网格')
+    parser.add_argument('--source_dataset', type=str, required=True,
+                        help='源数据集名称（例如 glo12v1_daily）')
+    parser.add_argument('--target_dataset', type=str, required=True,
+                        help='目标网格数据集名称（例如 era5_daily）')
+    parser.add_argument('--start_date', type=str, required=True,
+                        help='起始日期 (YYYY-MM-DD)')
+    parser.add_argument('--end_date', type=str, required=True,
+                        help='结束日期 (YYYY-MM-DD)')
+    parser.add_argument('--config', type=str, default='./config/config.yaml',
+                        help='配置文件路径')
+    parser.add_argument('--method', type=str, choices=['bilinear', 'conservative'],
+                        help='插值方法')
+    parser.add_argument('--workers', type=int, help='并行进程数')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    config_manager = ConfigManager()
+    config = config_manager.load_config(args.config)
+
+    options = {}
+    if args.method:
+        options['method'] = args.method
+    if args.workers:
+        options['workers'] = args.workers
+
+    results = colocate(config, args.source_dataset, args.target_dataset,
+                       datetime.strptime(args.start_date, "%Y-%m-%d"),
+                       datetime.strptime(args.end_date, "%Y-%m-%d"),
+                       options)
+
+    success_count = sum(1 for r in results.values() if r)
+    total_count = len(results)
+
+    print(f"\n重插值完成!")
+    print(f"成功: {success_count}/{total_count}")
+    print(f"失败: {total_count - success_count}/{total_count}")
+
+
+if __name__ == "__main__":
+    main()
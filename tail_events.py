@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+完成事件流读取命令行工具
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.config_manager import ConfigManager
+from utils.events import EventLog, event_options
+import argparse
+import json
+
+
+def main():
+    parser = argparse.ArgumentParser(description='读取/跟随下载完成事件，每行输出一条 JSON')
+    parser.add_argument('--config', type=str, default='./config/config.yaml',
+                        help='配置文件路径')
+    parser.add_argument('--consumer', type=str,
+                        help='消费者名称：从其已提交的偏移量继续，并在输出每条事件后提交')
+    parser.add_argument('--offset', type=int, help='从指定字节偏移量开始（覆盖已提交的偏移量）')
+    parser.add_argument('--dataset', type=str, nargs='+', help='只输出这些数据集的事件')
+    parser.add_argument('--follow', '-f', action='store_true', help='持续跟随新事件')
+    parser.add_argument('--poll_interval', type=float, default=0.2,
+                        help='跟随时检查新事件的间隔（秒）')
+
+    args = parser.parse_args()
+
+    config_manager = ConfigManager()
+    config = config_manager.load_config(args.config)
+    options = event_options(config)
+    log = EventLog(Path(options['path']), options['checksum'])
+
+    offset = args.offset
+    if offset is None:
+        offset = log.load_offset(args.consumer) if args.consumer else 0
+
+    events = log.tail(offset, args.poll_interval) if args.follow else log.read(offset)
+    try:
+        for next_offset, event in events:
+            if not args.dataset or event.get('dataset') in args.dataset:
+                print(json.dumps(dict(event, next_offset=next_offset), ensure_ascii=False),
+                      flush=True)
+            if args.consumer:
+                log.commit_offset(args.consumer, next_offset)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+本地归档索引：根据文件名解析数据集与时间覆盖范围
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 下载器输出命名：{dataset}_{YYYYMMDD}.nc（日/小时）与 {dataset}_{YYYY}_{MM}.nc（月）
+_DAILY_PATTERN = re.compile(r"^(?P<dataset>.+)_(?P<date>\d{8})\.nc$")
+_MONTHLY_PATTERN = re.compile(r"^(?P<dataset>.+)_(?P<year>\d{4})_(?P<month>\d{2})\.nc$")
+# 合并后的逐日文件：{dataset}_{YYYYMM}.nc（月）与 {dataset}_{YYYY}.nc（年）
+_MERGED_MONTH_PATTERN = re.compile(r"^(?P<dataset>.+)_(?P<year>\d{4})(?P<month>\d{2})\.nc$")
+_MERGED_YEAR_PATTERN = re.compile(r"^(?P<dataset>.+)_(?P<year>\d{4})\.nc$")
+
+
+def _add_month(dt: datetime) -> datetime:
+    if dt.month == 12:
+        return datetime(dt.year + 1, 1, 1)
+    return datetime(dt.year, dt.month + 1, 1)
+
+
+def parse_archive_filename(filename: str) -> Optional[Tuple[str, datetime, datetime]]:
+    """解析归档文件名，返回 (数据集名, 覆盖起点, 覆盖终点[不含])"""
+    match = _DAILY_PATTERN.match(filename)
+    if match:
+        try:
+            start = datetime.strptime(match.group('date'), "%Y%m%d")
+        except ValueError:
+            return None
+        return match.group('dataset'), start, start + timedelta(days=1)
+
+    match = _MONTHLY_PATTERN.match(filename) or _MERGED_MONTH_PATTERN.match(filename)
+    if match:
+        year, month = int(match.group('year')), int(match.group('month'))
+        if not 1 <= month <= 12:
+            return None
+        start = datetime(year, month, 1)
+        return match.group('dataset'), start, _add_month(start)
+
+    match = _MERGED_YEAR_PATTERN.match(filename)
+    if match:
+        year = int(match.group('year'))
+        return match.group('dataset'), datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+    return None
+
+
+class ArchiveIndex:
+    """输出目录的文件/时间索引
+
+    索引持久化为 JSON，仅当目录 mtime 变化时才重新扫描，
+    避免在网络文件系统上反复列出大目录。
+    """
+
+    def __init__(self, root: Path, index_name: str = ".archive_index.json"):
+        self.root = Path(root)
+        self.index_path = self.root / index_name
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._dir_mtime: Optional[float] = None
+        self._load()
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self._dir_mtime = data.get('dir_mtime')
+        except (OSError, ValueError) as e:
+            logger.warning(f"归档索引损坏，将重新扫描: {e}")
+            self.entries = {}
+            self._dir_mtime = None
+
+    def save(self) -> None:
+        """写回索引文件（先写临时文件再替换）"""
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dir_mtime': self._dir_mtime, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def refresh(self, force: bool = False) -> None:
+        """目录发生变化时重新扫描"""
+        if not self.root.exists():
+            self.entries = {}
+            return
+
+        dir_mtime = self.root.stat().st_mtime
+        if not force and self._dir_mtime == dir_mtime and self.entries:
+            return
+
+        entries: Dict[str, Dict[str, Any]] = {}
+        with os.scandir(self.root) as it:
+            for item in it:
+                if not item.is_file():
+                    continue
+                entry = self._make_entry(item.name, item.stat())
+                if entry:
+                    entries[item.name] = entry
+
+        self.entries = entries
+        self._dir_mtime = dir_mtime
+        self.save()
+        logger.info(f"归档索引已更新: {len(entries)} 个文件")
+
+    def add(self, path: Path) -> Optional[Dict[str, Any]]:
+        """增量登记单个新文件"""
+        path = Path(path)
+        entry = self._make_entry(path.name, path.stat())
+        if entry:
+            self.entries[path.name] = entry
+            self.save()
+        return entry
+
+    @staticmethod
+    def _make_entry(filename: str, stat: os.stat_result) -> Optional[Dict[str, Any]]:
+        parsed = parse_archive_filename(filename)
+        if not parsed:
+            return None
+        dataset, start, end = parsed
+        return {
+            'dataset': dataset,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+
+    def query(self, dataset_name: str, start: datetime,
+              end: datetime) -> List[Tuple[Path, datetime, datetime]]:
+        """返回与 [start, end] 有交集的文件，按时间排序"""
+        result = []
+        for filename, entry in self.entries.items():
+            if entry['dataset'] != dataset_name:
+                continue
+            file_start = datetime.fromisoformat(entry['start'])
+            file_end = datetime.fromisoformat(entry['end'])
+            if file_start <= end and file_end > start:
+                result.append((self.root / filename, file_start, file_end))
+        result.sort(key=lambda item: item[1])
+        return result
+
+    def coverage_gaps(self, dataset_name: str, start: datetime,
+                      end: datetime) -> List[Tuple[datetime, datetime]]:
+        """返回 [start, end] 中归档未覆盖的时间段（闭区间）"""
+        gaps = []
+        cursor = start
+        for _, file_start, file_end in self.query(dataset_name, start, end):
+            if file_start > cursor:
+                gaps.append((cursor, min(file_start - timedelta(seconds=1), end)))
+            cursor = max(cursor, file_end)
+            if cursor > end:
+                break
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
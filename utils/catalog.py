@@ -0,0 +1,288 @@
+"""
+数据集元数据目录：本地缓存各服务的变量列表、网格范围与时间轴，按 TTL 刷新，支持离线模式
+"""
+import json
+import logging
+import re
+import sqlite3
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    service     TEXT NOT NULL,
+    dataset_id  TEXT NOT NULL,
+    metadata    TEXT NOT NULL,
+    fetched_at  REAL NOT NULL,
+    PRIMARY KEY (service, dataset_id)
+);
+"""
+
+COORD_ALIASES = {
+    'time': 'time', 'valid_time': 'time',
+    'latitude': 'latitude', 'lat': 'latitude',
+    'longitude': 'longitude', 'lon': 'longitude',
+    'depth': 'depth',
+}
+
+_TIME_UNITS = {'milliseconds': 1e-3, 'seconds': 1.0, 'minutes': 60.0,
+               'hours': 3600.0, 'days': 86400.0}
+
+
+def catalog_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    """general.catalog 中的参数"""
+    general_cfg = config.get('general', {})
+    options = {'path': None, 'ttl_hours': 168, 'offline': False, 'validate': 'warn',
+               'timeout': 30}
+    options.update(general_cfg.get('catalog') or {})
+    if not options['path']:
+        output_base = Path(config.get('output_base_dir')
+                           or general_cfg.get('output_base_dir', './data'))
+        options['path'] = output_base / '.catalog.db'
+    return options
+
+
+class MetadataCatalog:
+    """基于 SQLite 的元数据缓存
+
+    条目在 ttl_hours 内视为新鲜；过期后重新拉取，拉取失败时退回旧条目。
+    离线模式只读取缓存，不访问网络。
+    """
+
+    def __init__(self, path: Path, ttl_hours: float = 168, offline: bool = False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = float(ttl_hours) * 3600
+        self.offline = offline
+        self.conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def cached(self, service: str, dataset_id: str) -> Optional[Dict[str, Any]]:
+        """读取缓存条目（含 fetched_at），不存在时返回 None"""
+        row = self.conn.execute(
+            "SELECT metadata, fetched_at FROM datasets WHERE service = ? AND dataset_id = ?",
+            (service, dataset_id)).fetchone()
+        if row is None:
+            return None
+        metadata = json.loads(row['metadata'])
+        metadata['fetched_at'] = row['fetched_at']
+        return metadata
+
+    def store(self, service: str, dataset_id: str, metadata: Dict[str, Any]) -> None:
+        self.conn.execute("""
+            INSERT OR REPLACE INTO datasets (service, dataset_id, metadata, fetched_at)
+            VALUES (?, ?, ?, ?)
+        """, (service, dataset_id, json.dumps(metadata, ensure_ascii=False), time.time()))
+
+    def get(self, service: str, dataset_id: str,
+            fetcher: Callable[[], Dict[str, Any]],
+            refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """返回数据集元数据：缓存新鲜时直接返回，否则调用 fetcher 拉取并缓存"""
+        entry = self.cached(service, dataset_id)
+        fresh = entry is not None and time.time() - entry['fetched_at'] < self.ttl
+        if self.offline:
+            if entry is None:
+                logger.warning(f"离线模式下没有 {service}/{dataset_id} 的元数据缓存")
+            return entry
+        if fresh and not refresh:
+            return entry
+
+        try:
+            metadata = fetcher()
+        except Exception as e:
+            if entry is not None:
+                logger.warning(f"拉取 {service}/{dataset_id} 元数据失败，使用旧缓存: {e}")
+                return entry
+            logger.error(f"拉取 {service}/{dataset_id} 元数据失败: {e}")
+            return None
+        self.store(service, dataset_id, metadata)
+        return self.cached(service, dataset_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT service, dataset_id, fetched_at FROM datasets ORDER BY service, dataset_id")
+        return [dict(row) for row in rows]
+
+
+def _epoch_to_iso(value: float, units: str) -> Optional[str]:
+    """将 “<单位> since <起点>” 形式的时间值转为 ISO 字符串"""
+    match = re.match(r'\s*(\w+)\s+since\s+(\d{4}-\d{2}-\d{2})', units or '')
+    if not match or match.group(1) not in _TIME_UNITS:
+        return None
+    origin = datetime.fromisoformat(match.group(2)).replace(tzinfo=timezone.utc)
+    moment = origin + timedelta(seconds=float(value) * _TIME_UNITS[match.group(1)])
+    return moment.replace(tzinfo=None).isoformat()
+
+
+def _merge_coordinate(coords: Dict[str, Dict[str, Any]], name: str,
+                      minimum: Any, maximum: Any, step: Any = None,
+                      values: Optional[List[Any]] = None, units: Optional[str] = None) -> None:
+    entry = coords.setdefault(name, {'min': None, 'max': None, 'step': None, 'units': units})
+    if minimum is not None:
+        entry['min'] = minimum if entry['min'] is None else min(entry['min'], minimum)
+    if maximum is not None:
+        entry['max'] = maximum if entry['max'] is None else max(entry['max'], maximum)
+    if step is not None:
+        entry['step'] = step
+    if values:
+        entry['values'] = sorted(set(entry.get('values', [])) | set(values))
+
+
+def normalize_cmems(described: Any, dataset_id: str) -> Dict[str, Any]:
+    """将 copernicusmarine.describe 的结果整理为统一格式"""
+    data = described.model_dump() if hasattr(described, 'model_dump') else described
+    for product in data.get('products', []):
+        for dataset in product.get('datasets', []):
+            if dataset.get('dataset_id') != dataset_id:
+                continue
+            versions = sorted(dataset.get('versions', []), key=lambda v: v.get('label') or '')
+            if not versions:
+                break
+            variables: Dict[str, Dict[str, Any]] = {}
+            coords: Dict[str, Dict[str, Any]] = {}
+            for part in versions[-1].get('parts', []):
+                for service in part.get('services', []):
+                    for variable in service.get('variables', []):
+                        variables.setdefault(variable['short_name'], {
+                            'standard_name': variable.get('standard_name'),
+                            'units': variable.get('units'),
+                        })
+                        for coord in variable.get('coordinates', []):
+                            # 1.x 的字段名为 coordinates_id
+                            name = COORD_ALIASES.get(coord.get('coordinate_id')
+                                                     or coord.get('coordinates_id'))
+                            if name is None:
+                                continue
+                            minimum, maximum = coord.get('minimum_value'), coord.get('maximum_value')
+                            values = coord.get('values')
+                            if minimum is None and values:
+                                minimum, maximum = min(values), max(values)
+                            if name == 'time':
+                                units = coord.get('coordinate_unit') or coord.get('units') or ''
+                                minimum = _epoch_to_iso(minimum, units) if minimum is not None else None
+                                maximum = _epoch_to_iso(maximum, units) if maximum is not None else None
+                                # 时间步长统一为秒
+                                step = coord.get('step')
+                                _merge_coordinate(coords, name, minimum, maximum,
+                                                  step * _TIME_UNITS.get(units.split(' ')[0], 1.0)
+                                                  if step else None, units='ISO 8601')
+                            else:
+                                _merge_coordinate(coords, name, minimum, maximum, coord.get('step'),
+                                                  values if name == 'depth' else None)
+            return {
+                'dataset_id': dataset_id,
+                'title': product.get('title'),
+                'version': versions[-1].get('label'),
+                'variables': variables,
+                'coordinates': coords,
+            }
+    raise ValueError(f"目录中没有数据集 {dataset_id}")
+
+
+def fetch_cmems(dataset_id: str) -> Dict[str, Any]:
+    """从 Copernicus Marine 目录拉取数据集元数据"""
+    from copernicusmarine import describe
+
+    try:
+        described = describe(dataset_id=dataset_id, disable_progress_bar=True)
+    except TypeError:
+        # copernicusmarine 1.x 没有 dataset_id 参数：按关键字过滤目录，
+        # 再由 normalize_cmems 按 dataset_id 选出数据集
+        described = describe(include_datasets=True, contains=[dataset_id],
+                             disable_progress_bar=True)
+    return normalize_cmems(described, dataset_id)
+
+
+def _get_json(url: str, timeout: float) -> Dict[str, Any]:
+    request = urllib.request.Request(url, headers={'Accept': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def normalize_cds(process: Dict[str, Any], collection: Dict[str, Any],
+                  dataset_id: str) -> Dict[str, Any]:
+    """将 CDS 处理描述与 STAC collection 整理为统一格式"""
+    variables: Dict[str, Dict[str, Any]] = {}
+    variable_input = (process.get('inputs') or {}).get('variable') or {}
+    schema = variable_input.get('schema') or {}
+    for name in (schema.get('items') or {}).get('enum') or schema.get('enum') or []:
+        variables[name] = {}
+
+    coords: Dict[str, Dict[str, Any]] = {}
+    extent = collection.get('extent') or {}
+    bbox = ((extent.get('spatial') or {}).get('bbox') or [[]])[0]
+    if len(bbox) == 4:
+        _merge_coordinate(coords, 'longitude', bbox[0], bbox[2])
+        _merge_coordinate(coords, 'latitude', bbox[1], bbox[3])
+    interval = ((extent.get('temporal') or {}).get('interval') or [[]])[0]
+    if len(interval) == 2:
+        start, end = (value[:19] if value else None for value in interval)
+        _merge_coordinate(coords, 'time', start, end, units='ISO 8601')
+
+    return {
+        'dataset_id': dataset_id,
+        'title': collection.get('title') or process.get('title'),
+        'variables': variables,
+        'coordinates': coords,
+    }
+
+
+def fetch_cds(dataset_id: str, api_url: str, timeout: float = 30) -> Dict[str, Any]:
+    """从 CDS REST API 拉取数据集元数据（处理描述与目录条目）"""
+    base = api_url.rstrip('/')
+    process = _get_json(f"{base}/retrieve/v1/processes/{dataset_id}", timeout)
+    collection = _get_json(f"{base}/catalogue/v1/collections/{dataset_id}", timeout)
+    return normalize_cds(process, collection, dataset_id)
+
+
+def _disjoint(low: float, high: float, coord: Dict[str, Any]) -> bool:
+    """请求区间 [low, high] 与坐标范围（按步长放宽）是否不相交"""
+    tolerance = abs(coord.get('step') or 0)
+    return ((coord.get('min') is not None and high < coord['min'] - tolerance)
+            or (coord.get('max') is not None and low > coord['max'] + tolerance))
+
+
+def validate_request(metadata: Dict[str, Any], variables: Optional[List[str]] = None,
+                     spatial_range: Optional[List[float]] = None,
+                     depth_range: Optional[List[float]] = None,
+                     start: Optional[datetime] = None,
+                     end: Optional[datetime] = None) -> List[str]:
+    """按元数据检查请求参数，返回问题列表（为空表示通过）"""
+    problems = []
+    known = metadata.get('variables') or {}
+    if variables and known:
+        unknown = [name for name in variables if name not in known]
+        if unknown:
+            problems.append(f"未知变量 {unknown}，可用: {sorted(known)}")
+
+    coords = metadata.get('coordinates') or {}
+    if spatial_range:
+        lon_min, lon_max, lat_min, lat_max = spatial_range
+        lon = coords.get('longitude')
+        # 0~360 与 -180~180 两种经度约定均视为可用，只要求与数据集范围相交
+        if lon and all(_disjoint(lon_min + shift, lon_max + shift, lon)
+                       for shift in (-360, 0, 360)):
+            problems.append(f"经度范围 [{lon_min}, {lon_max}] 与数据集 [{lon['min']}, {lon['max']}] 不相交")
+        lat = coords.get('latitude')
+        if lat and _disjoint(lat_min, lat_max, lat):
+            problems.append(f"纬度范围 [{lat_min}, {lat_max}] 与数据集 [{lat['min']}, {lat['max']}] 不相交")
+    if depth_range and coords.get('depth'):
+        depth = coords['depth']
+        if _disjoint(depth_range[0], depth_range[1], depth):
+            problems.append(f"深度范围 {depth_range} 与数据集 [{depth['min']}, {depth['max']}] 不相交")
+
+    time_coord = coords.get('time') or {}
+    if start and time_coord.get('max') and start > datetime.fromisoformat(time_coord['max']):
+        problems.append(f"起始时间 {start:%Y-%m-%d} 晚于数据集最后时间 {time_coord['max']}")
+    if end and time_coord.get('min') and end < datetime.fromisoformat(time_coord['min']):
+        problems.append(f"结束时间 {end:%Y-%m-%d} 早于数据集最早时间 {time_coord['min']}")
+    return problems
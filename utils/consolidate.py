@@ -0,0 +1,267 @@
+"""
+逐日文件合并：将 {dataset}_{YYYYMMDD}.nc 按时间流式拼接为月/年文件
+"""
+import calendar
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import netCDF4
+import numpy as np
+
+from utils.archive_index import ArchiveIndex
+from utils.nc_io import copy_variable, create_like, find_time_dim, open_raw
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS: Dict[str, Any] = {
+    'period': 'monthly',
+    'max_memory_mb': 256,
+    'workers': 2,
+    'chunks': None,
+    'compression': 'zlib',
+    'complevel': 4,
+    'shuffle': True,
+    'verify': 'sample',
+    'remove_sources': False,
+    'complete_only': True,
+    'overwrite': False,
+}
+
+
+def _target_name(dataset_name: str, day: datetime, period: str) -> str:
+    if period == 'yearly':
+        return f"{dataset_name}_{day:%Y}.nc"
+    return f"{dataset_name}_{day:%Y%m}.nc"
+
+
+def _expected_days(key_day: datetime, period: str) -> int:
+    if period == 'yearly':
+        return 366 if calendar.isleap(key_day.year) else 365
+    return calendar.monthrange(key_day.year, key_day.month)[1]
+
+
+def plan_groups(source_dir: Path, dataset_name: str, period: str = 'monthly',
+                complete_only: bool = True,
+                start: Optional[datetime] = None,
+                end: Optional[datetime] = None) -> Dict[str, List[Path]]:
+    """按月/年分组逐日文件，返回 {目标文件名: [源文件...]}"""
+    if period not in ('monthly', 'yearly'):
+        raise ValueError(f"不支持的合并周期: {period}")
+
+    index = ArchiveIndex(source_dir)
+    index.refresh()
+    start = start or datetime.min
+    end = end or datetime.max
+
+    groups: Dict[str, List[Tuple[datetime, Path]]] = {}
+    for path, file_start, file_end in index.query(dataset_name, start, end):
+        if file_end - file_start != timedelta(days=1):
+            continue
+        groups.setdefault(_target_name(dataset_name, file_start, period), []).append(
+            (file_start, path))
+
+    result: Dict[str, List[Path]] = {}
+    for target, items in sorted(groups.items()):
+        items.sort()
+        if complete_only and len(items) != _expected_days(items[0][0], period):
+            logger.info(f"⏭️ {target} 逐日文件不完整 ({len(items)} 天)，跳过")
+            continue
+        result[target] = [path for _, path in items]
+    return result
+
+
+def _time_values(src: netCDF4.Dataset, time_dim: str, units: Optional[str],
+                 calendar_name: str) -> np.ndarray:
+    """读取时间坐标并换算到目标文件的单位"""
+    var = src.variables[time_dim]
+    values = var[:]
+    src_units = getattr(var, 'units', None)
+    if units and src_units and src_units != units:
+        dates = netCDF4.num2date(values, src_units,
+                                 getattr(var, 'calendar', calendar_name))
+        values = netCDF4.date2num(dates, units, calendar_name).astype(var.dtype)
+    return np.asarray(values)
+
+
+def _source_plan(sources: List[Path], time_dim: str, units: Optional[str],
+                 calendar_name: str) -> List[Tuple[Path, int, int]]:
+    """确定每个源文件写入的时间步，返回 [(路径, 跳过的前导步数, 总步数)]
+
+    CMEMS 的逐日文件包含次日 00:00 的记录，与下一个文件的首个记录重复；
+    时间不晚于已写入记录的前导步跳过，保证合并结果的时间坐标严格递增。
+    """
+    plan = []
+    last = None
+    for path in sources:
+        with open_raw(path) as src:
+            n = len(src.dimensions[time_dim])
+            skip = 0
+            if time_dim in src.variables and n:
+                values = _time_values(src, time_dim, units, calendar_name)
+                if last is not None:
+                    while skip < n and values[skip] <= last:
+                        skip += 1
+                if skip < n:
+                    last = values[-1]
+        if skip:
+            logger.debug(f"{path} 跳过与前一文件重复的 {skip} 个时间步")
+        plan.append((path, skip, n))
+    return plan
+
+
+def _verify(target: Path, plan: List[Tuple[Path, int, int]], time_dim: str,
+            max_bytes: int, mode: str) -> None:
+    """校验合并结果；sample 只比较每个源文件首尾时间步，full 逐块比较"""
+    with open_raw(target) as dst:
+        units = getattr(dst.variables[time_dim], 'units', None) \
+            if time_dim in dst.variables else None
+        cal = getattr(dst.variables[time_dim], 'calendar', 'standard') \
+            if time_dim in dst.variables else 'standard'
+        if time_dim in dst.variables:
+            times = np.asarray(dst.variables[time_dim][:])
+            if times.size > 1 and np.any(np.diff(times) <= 0):
+                raise ValueError("时间坐标存在重复或乱序")
+        offset = 0
+        for path, skip, n in plan:
+            kept = n - skip
+            if kept <= 0:
+                continue
+            with open_raw(path) as src:
+                if time_dim in src.variables:
+                    expected = _time_values(src, time_dim, units, cal)[skip:]
+                    actual = dst.variables[time_dim][offset:offset + kept]
+                    if not np.array_equal(expected, actual):
+                        raise ValueError(f"时间坐标不一致: {path}")
+                for name, src_var in src.variables.items():
+                    if time_dim not in src_var.dimensions or name == time_dim:
+                        continue
+                    axis = src_var.dimensions.index(time_dim)
+                    dst_var = dst.variables[name]
+                    steps = range(kept) if mode == 'full' else sorted({0, kept - 1})
+                    for step in steps:
+                        index = [slice(None)] * src_var.ndim
+                        index[axis] = skip + step
+                        target_index = list(index)
+                        target_index[axis] = offset + step
+                        if not np.array_equal(src_var[tuple(index)],
+                                              dst_var[tuple(target_index)],
+                                              equal_nan=src_var.dtype.kind == 'f'):
+                            raise ValueError(f"变量 {name} 数据不一致: {path} 第 {skip + step} 步")
+                offset += kept
+        if len(dst.dimensions[time_dim]) != offset:
+            raise ValueError(f"时间长度不一致: {len(dst.dimensions[time_dim])} != {offset}")
+
+
+def consolidate_group(sources: List[Path], target: Path,
+                      options: Dict[str, Any]) -> bool:
+    """将一组逐日文件流式拼接为单个文件（在工作进程中执行）"""
+    opts = dict(DEFAULT_OPTIONS, **(options or {}))
+    max_bytes = int(opts['max_memory_mb']) * 1024 * 1024
+    tmp_path = target.with_suffix('.nc.tmp')
+
+    try:
+        with open_raw(sources[0]) as first:
+            time_dim = find_time_dim(first)
+            if time_dim is None:
+                raise ValueError(f"未找到时间维: {sources[0]}")
+
+            with open_raw(tmp_path, 'w', format='NETCDF4') as dst:
+                create_like(first, dst, unlimited_dim=time_dim,
+                            chunks=opts['chunks'], compression=opts['compression'],
+                            complevel=opts['complevel'], shuffle=opts['shuffle'])
+                # 较小的块缓存，保证单进程内存不超过上限
+                for var in dst.variables.values():
+                    var.set_var_chunk_cache(size=min(max_bytes, 32 * 1024 * 1024))
+
+                # 不含时间维的变量（经纬度、深度等）只复制一次
+                for name, var in first.variables.items():
+                    if time_dim not in var.dimensions:
+                        copy_variable(var, dst.variables[name], max_bytes)
+
+                time_var = dst.variables.get(time_dim)
+                units = getattr(time_var, 'units', None) if time_var is not None else None
+                cal = getattr(time_var, 'calendar', 'standard') \
+                    if time_var is not None else 'standard'
+                plan = _source_plan(sources, time_dim, units, cal)
+
+                offset = 0
+                for path, skip, n in plan:
+                    kept = n - skip
+                    if kept <= 0:
+                        continue
+                    with open_raw(path) as src:
+                        for name, var in src.variables.items():
+                            if time_dim not in var.dimensions:
+                                continue
+                            if name not in dst.variables:
+                                raise ValueError(f"{path} 含有首个文件中不存在的变量 {name}")
+                            if name == time_dim:
+                                dst.variables[name][offset:offset + kept] = \
+                                    _time_values(src, time_dim, units, cal)[skip:]
+                                continue
+                            copy_variable(var, dst.variables[name], max_bytes,
+                                          axis=var.dimensions.index(time_dim),
+                                          offset=offset, skip=skip)
+                        offset += kept
+
+        if opts['verify']:
+            _verify(tmp_path, plan, time_dim, max_bytes, opts['verify'])
+
+        os.replace(tmp_path, target)
+        logger.info(f"✅ 合并完成: {target} ({len(sources)} 个文件)")
+
+        if opts['remove_sources']:
+            for path in sources:
+                path.unlink()
+            logger.info(f"已删除源文件 {len(sources)} 个")
+        return True
+
+    except Exception as e:
+        logger.error(f"合并失败 {target}: {e}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return False
+
+
+def consolidate(source_dir: Path, dataset_name: str,
+                options: Optional[Dict[str, Any]] = None,
+                target_dir: Optional[Path] = None,
+                start: Optional[datetime] = None,
+                end: Optional[datetime] = None) -> Dict[str, bool]:
+    """合并数据集的逐日文件，按月/年并行执行"""
+    opts = dict(DEFAULT_OPTIONS, **(options or {}))
+    source_dir = Path(source_dir)
+    target_dir = Path(target_dir) if target_dir else source_dir
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    groups = plan_groups(source_dir, dataset_name, opts['period'],
+                         opts['complete_only'], start, end)
+    results: Dict[str, bool] = {}
+    pending = {}
+    for name, sources in groups.items():
+        target = target_dir / name
+        if target.exists() and not opts['overwrite']:
+            logger.info(f"⏭️ 文件已存在，跳过: {target}")
+            results[name] = True
+            continue
+        pending[name] = (sources, target)
+
+    if not pending:
+        return results
+
+    # 总内存约为 workers * max_memory_mb
+    with ProcessPoolExecutor(max_workers=int(opts['workers'])) as executor:
+        futures = {
+            executor.submit(consolidate_group, sources, target, opts): name
+            for name, (sources, target) in pending.items()
+        }
+        for current, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            results[name] = future.result()
+            logger.info(f"进度: {current}/{len(futures)} ({current / len(futures) * 100:.1f}%)")
+
+    return results
@@ -0,0 +1,254 @@
+"""
+派生变量：按块向量化计算风速/风向、相对湿度/比湿，写回原文件或旁路文件
+"""
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+from utils.nc_io import iter_slabs, open_raw
+
+logger = logging.getLogger(__name__)
+
+# 干空气与水汽分子量之比
+EPSILON = 0.621981
+
+
+def saturation_vapour_pressure(temperature: np.ndarray) -> np.ndarray:
+    """水面饱和水汽压 (Pa)，Tetens 公式（IFS 系数），输入温度单位 K"""
+    return 611.21 * np.exp(17.502 * (temperature - 273.16) / (temperature - 32.19))
+
+
+def wind_speed(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    return np.hypot(u, v)
+
+
+def wind_direction(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """气象风向（风的来向，正北为 0°，顺时针）"""
+    return np.mod(np.degrees(np.arctan2(-u, -v)), 360.0)
+
+
+def relative_humidity(temperature: np.ndarray, dewpoint: np.ndarray) -> np.ndarray:
+    rh = 100.0 * saturation_vapour_pressure(dewpoint) / saturation_vapour_pressure(temperature)
+    return np.clip(rh, 0.0, 100.0)
+
+
+def specific_humidity(dewpoint: np.ndarray, pressure: np.ndarray) -> np.ndarray:
+    e = saturation_vapour_pressure(dewpoint)
+    return EPSILON * e / (pressure - (1.0 - EPSILON) * e)
+
+
+# 输入变量以候选名给出：CDS NetCDF 短名在前，长名在后
+DERIVED_VARIABLES: Dict[str, Dict[str, Any]] = {
+    'wind_speed_10m': {
+        'inputs': [('u10', '10m_u_component_of_wind'), ('v10', '10m_v_component_of_wind')],
+        'func': wind_speed,
+        'attrs': {'units': 'm s-1', 'long_name': '10 metre wind speed'},
+    },
+    'wind_direction_10m': {
+        'inputs': [('u10', '10m_u_component_of_wind'), ('v10', '10m_v_component_of_wind')],
+        'func': wind_direction,
+        'attrs': {'units': 'degree', 'long_name': '10 metre wind direction (from)'},
+    },
+    'relative_humidity_2m': {
+        'inputs': [('t2m', '2m_temperature'), ('d2m', '2m_dewpoint_temperature')],
+        'func': relative_humidity,
+        'attrs': {'units': '%', 'long_name': '2 metre relative humidity'},
+    },
+    'specific_humidity_2m': {
+        'inputs': [('d2m', '2m_dewpoint_temperature'), ('sp', 'surface_pressure')],
+        'func': specific_humidity,
+        # 需要地面气压：高原地区用常数气压误差很大，缺少 sp 时不计算
+        'attrs': {'units': 'kg kg-1', 'long_name': '2 metre specific humidity'},
+    },
+}
+
+
+def register(name: str, inputs: List[Sequence[str]], func: Callable[..., np.ndarray],
+             attrs: Optional[Dict[str, Any]] = None) -> None:
+    """注册自定义派生变量"""
+    DERIVED_VARIABLES[name] = {'inputs': [tuple(i) for i in inputs], 'func': func,
+                               'attrs': attrs or {}}
+
+
+def _resolve_inputs(ds, spec: Dict[str, Any]) -> Optional[List[Any]]:
+    """按候选名查找输入变量，任一输入缺失时返回 None"""
+    resolved = []
+    for candidates in spec['inputs']:
+        name = next((c for c in candidates if c in ds.variables), None)
+        if name is None:
+            return None
+        resolved.append(ds.variables[name])
+    return resolved
+
+
+def derive_file(path: Path, names: List[str], mode: str = 'inplace',
+                sidecar_dir: Optional[Path] = None, max_memory_mb: int = 64,
+                complevel: int = 4, overwrite: bool = False) -> Optional[Path]:
+    """为单个文件计算派生变量，按块流式读写，返回写入的文件路径
+
+    mode 为 inplace 时追加到原文件；sidecar 时写入 {sidecar_dir}/{文件名}_derived.nc。
+    写入在临时副本中进行，完成后替换目标文件；中途失败时目标文件保持原样。
+    """
+    unknown = [n for n in names if n not in DERIVED_VARIABLES]
+    if unknown:
+        raise ValueError(f"未知的派生变量: {unknown}")
+    if mode not in ('inplace', 'sidecar'):
+        raise ValueError(f"不支持的写入方式: {mode}")
+
+    path = Path(path)
+    max_bytes = int(max_memory_mb) * 1024 * 1024
+    if mode == 'inplace':
+        target_path = path
+    else:
+        sidecar_dir = Path(sidecar_dir) if sidecar_dir else path.parent / 'derived'
+        sidecar_dir.mkdir(parents=True, exist_ok=True)
+        target_path = sidecar_dir / f"{path.stem}_derived.nc"
+
+    # 先确定需要写入的变量，没有时不复制文件
+    existing = set()
+    if target_path.exists() and not overwrite:
+        with open_raw(target_path) as target:
+            existing = set(target.variables)
+    pending = []
+    with open_raw(path) as src:
+        for name in names:
+            if name in existing:
+                continue
+            spec = DERIVED_VARIABLES[name]
+            if _resolve_inputs(src, spec) is None:
+                required = [candidates[-1] for candidates in spec['inputs']]
+                logger.warning(f"{path.name} 缺少 {name} 的输入变量（需要 {required}），跳过")
+                continue
+            pending.append(name)
+    if not pending:
+        return target_path if target_path.exists() else None
+
+    tmp_path = target_path.with_name(f"{target_path.name}.tmp")
+    if target_path.exists():
+        shutil.copy2(target_path, tmp_path)
+    try:
+        if mode == 'inplace':
+            src = dst = open_raw(tmp_path, 'a')
+        else:
+            src = open_raw(path)
+            dst = open_raw(tmp_path, 'a' if tmp_path.exists() else 'w', format='NETCDF4')
+
+        try:
+            # 读取时需要物理值，打开自动缩放与掩码
+            src.set_auto_maskandscale(True)
+            for name in pending:
+                spec = DERIVED_VARIABLES[name]
+                inputs = _resolve_inputs(src, spec)
+                template = inputs[0]
+                if dst is not src:
+                    _copy_grid(src, dst, template.dimensions)
+
+                if name not in dst.variables:
+                    chunking = template.chunking()
+                    out = dst.createVariable(
+                        name, 'f4', template.dimensions, fill_value=np.float32(np.nan),
+                        compression='zlib', complevel=complevel, shuffle=True,
+                        chunksizes=None if chunking == 'contiguous' else chunking)
+                    out.setncatts(spec['attrs'])
+                out = dst.variables[name]
+                out.set_auto_maskandscale(False)
+
+                # 单块内存：输入数 + 输出，按 float64 计算
+                block_bytes = max(1, max_bytes // (len(inputs) + 1))
+                for index in iter_slabs(template.shape, 8, block_bytes):
+                    args = [np.ma.filled(value[index].astype('f8'), np.nan) for value in inputs]
+                    out[index] = spec['func'](*args).astype('f4')
+        finally:
+            if dst is not src:
+                dst.close()
+            src.close()
+
+        os.replace(tmp_path, target_path)
+        logger.info(f"✅ 派生变量 {pending} 已写入: {target_path}")
+        return target_path
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
+
+def _copy_grid(src, dst, dimensions: Sequence[str]) -> None:
+    """旁路文件中创建所需维度与坐标变量"""
+    for dim in dimensions:
+        if dim in dst.dimensions:
+            continue
+        size = src.dimensions[dim]
+        dst.createDimension(dim, None if size.isunlimited() else len(size))
+        if dim in src.variables:
+            coord = src.variables[dim]
+            coord.set_auto_maskandscale(False)
+            out = dst.createVariable(dim, coord.datatype, coord.dimensions)
+            out.setncatts({k: coord.getncattr(k) for k in coord.ncattrs()
+                           if k != '_FillValue'})
+            out.set_auto_maskandscale(False)
+            out[:] = coord[:]
+            coord.set_auto_maskandscale(True)
+
+
+def derive_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    """processing.derived 中的通用参数"""
+    options = {'mode': 'inplace', 'sidecar_dir': None, 'max_memory_mb': 64, 'complevel': 4}
+    options.update(config.get('processing', {}).get('derived') or {})
+    return options
+
+
+def dataset_derived(config: Dict[str, Any], dataset_name: str) -> List[str]:
+    """数据集在 config.yaml 中声明的派生变量"""
+    for service in ('c3s', 'cmems'):
+        dataset_cfg = config.get(service, {}).get('datasets', {}).get(dataset_name)
+        if dataset_cfg:
+            return list(dataset_cfg.get('derived') or [])
+    return []
+
+
+def derive_archive(config: Dict[str, Any], dataset_name: str,
+                   names: Optional[List[str]] = None,
+                   options: Optional[Dict[str, Any]] = None,
+                   start=None, end=None, overwrite: bool = False) -> Dict[str, bool]:
+    """对数据集已有的归档文件批量计算派生变量，进程池并行"""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from datetime import datetime
+
+    from utils.archive_index import ArchiveIndex
+
+    opts = derive_options(config)
+    opts.update(options or {})
+    names = names or dataset_derived(config, dataset_name)
+    if not names:
+        raise ValueError(f"数据集 {dataset_name} 未配置派生变量")
+
+    general_cfg = config.get('general', {})
+    output_dir = Path(config.get('output_base_dir')
+                      or general_cfg.get('output_base_dir', './data'))
+    index = ArchiveIndex(output_dir)
+    index.refresh()
+    files = [path for path, _, _ in
+             index.query(dataset_name, start or datetime.min, end or datetime.max)]
+
+    results: Dict[str, bool] = {}
+    if not files:
+        return results
+    with ProcessPoolExecutor(max_workers=int(opts.get('workers', 2))) as executor:
+        futures = {executor.submit(derive_file, path, names, opts['mode'],
+                                   opts['sidecar_dir'], opts['max_memory_mb'],
+                                   opts['complevel'], overwrite): path
+                   for path in files}
+        for current, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                future.result()
+                results[path.name] = True
+            except Exception as e:
+                logger.error(f"派生变量计算失败 {path}: {e}")
+                results[path.name] = False
+            logger.info(f"进度: {current}/{len(futures)} ({current / len(futures) * 100:.1f}%)")
+    return results
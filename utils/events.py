@@ -0,0 +1,149 @@
+"""
+完成事件流：每个通过校验的文件追加一条 JSON 事件，下游按偏移量读取/跟随，无需扫描输出目录
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+from utils.archive_index import parse_archive_filename
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CHECKSUMS = ('sha256', 'md5', 'none')
+
+
+def event_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    """general.events 中的参数"""
+    general_cfg = config.get('general', {})
+    options = {'enabled': False, 'path': None, 'checksum': 'sha256'}
+    options.update(general_cfg.get('events') or {})
+    if not options['path']:
+        output_base = Path(config.get('output_base_dir')
+                           or general_cfg.get('output_base_dir', './data'))
+        options['path'] = output_base / '.events' / 'events.jsonl'
+    return options
+
+
+def file_checksum(path: Path, algorithm: str = 'sha256', block_size: int = 1 << 20) -> Optional[str]:
+    """流式计算文件校验和"""
+    if algorithm == 'none':
+        return None
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return f"{algorithm}:{digest.hexdigest()}"
+
+
+class EventLog:
+    """追加写入的 JSONL 事件日志
+
+    每条事件为一行，写入时加文件锁并一次性写出整行，多个下载进程可同时追加。
+    读者以字节偏移量作为游标，只读取以换行结尾的完整行。
+    """
+
+    def __init__(self, path: Path, checksum: str = 'sha256'):
+        if checksum not in CHECKSUMS:
+            raise ValueError(f"不支持的校验算法: {checksum}")
+        self.path = Path(path)
+        self.checksum = checksum
+        self.offsets_dir = self.path.parent / 'offsets'
+
+    def append(self, event: Dict[str, Any]) -> int:
+        """追加一条事件，返回其起始偏移量"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        line = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            offset = os.lseek(fd, 0, os.SEEK_END)
+            os.write(fd, line)
+            return offset
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def publish_file(self, path: Path, service: Optional[str] = None) -> Dict[str, Any]:
+        """为一个已校验的文件发布完成事件"""
+        path = Path(path)
+        stat = path.stat()
+        event: Dict[str, Any] = {
+            'event': 'file_completed',
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'host': socket.gethostname(),
+            'service': service,
+            'path': str(path.resolve()),
+            'dataset': None,
+            'start': None,
+            'end': None,
+            'size': stat.st_size,
+            'checksum': file_checksum(path, self.checksum),
+        }
+        parsed = parse_archive_filename(path.name)
+        if parsed:
+            dataset, start, end = parsed
+            event.update(dataset=dataset, start=start.isoformat(), end=end.isoformat())
+        event['offset'] = self.append(event)
+        return event
+
+    def read(self, offset: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """从 offset 开始读取完整事件，产出 (下一条的偏移量, 事件)"""
+        if not self.path.exists():
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # 写入中的半行，留到下次读取
+                    break
+                offset += len(line)
+                try:
+                    yield offset, json.loads(line)
+                except ValueError:
+                    logger.warning(f"跳过损坏的事件行 (偏移量 {offset - len(line)})")
+
+    def tail(self, offset: int = 0, poll_interval: float = 0.2) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """持续跟随新事件；无新数据时只对日志文件做一次 stat"""
+        while True:
+            size = self.path.stat().st_size if self.path.exists() else 0
+            start = offset
+            if size > offset:
+                for offset, event in self.read(offset):
+                    yield offset, event
+            if offset == start:
+                time.sleep(poll_interval)
+
+    def load_offset(self, consumer: str) -> int:
+        """读取消费者已提交的偏移量"""
+        path = self.offsets_dir / consumer
+        if not path.exists():
+            return 0
+        return int(path.read_text(encoding='utf-8').strip() or 0)
+
+    def commit_offset(self, consumer: str, offset: int) -> None:
+        """原子地保存消费者偏移量"""
+        self.offsets_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.offsets_dir / f".{consumer}.tmp"
+        tmp_path.write_text(str(offset), encoding='utf-8')
+        os.replace(tmp_path, self.offsets_dir / consumer)
+
+
+def event_log(config: Dict[str, Any]) -> Optional[EventLog]:
+    """按配置创建事件日志，未开启时返回 None"""
+    options = event_options(config)
+    if not options['enabled']:
+        return None
+    return EventLog(Path(options['path']), options['checksum'])
@@ -0,0 +1,39 @@
+"""
+GRIB 转 NetCDF：在本地进程池中转换 CDS 返回的 GRIB 文件
+"""
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def convert_grib_to_netcdf(grib_path: Path, nc_path: Path,
+                           keep_grib: bool = False, complevel: int = 4) -> bool:
+    """将 GRIB 文件转换为压缩 NetCDF（在工作进程中执行）
+
+    ERA5 的 GRIB 可能包含多种 stepType/层次类型，cfgrib 会拆成多个数据集，
+    这里合并后一次写出；先写临时文件再替换，避免留下不完整的 .nc。
+    """
+    import cfgrib
+    import xarray as xr
+
+    grib_path, nc_path = Path(grib_path), Path(nc_path)
+    tmp_path = nc_path.with_suffix('.nc.tmp')
+    try:
+        datasets = cfgrib.open_datasets(str(grib_path), backend_kwargs={'indexpath': ''})
+        ds = xr.merge(datasets, compat='override', combine_attrs='drop_conflicts')
+        encoding = {name: {'zlib': True, 'complevel': complevel} for name in ds.data_vars}
+        ds.to_netcdf(tmp_path, encoding=encoding)
+        for item in datasets:
+            item.close()
+        os.replace(tmp_path, nc_path)
+        if not keep_grib:
+            grib_path.unlink()
+        logger.info(f"✅ GRIB 转换完成: {nc_path}")
+        return True
+    except Exception as e:
+        logger.error(f"GRIB 转换失败 {grib_path}: {e}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return False
@@ -0,0 +1,345 @@
+"""
+本地子集查询：优先从已下载归档中读取区域/时间/深度切片，仅对缺口回退到网络下载
+"""
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+import xarray as xr
+
+from utils.archive_index import ArchiveIndex
+
+logger = logging.getLogger(__name__)
+
+TIME_NAMES = ('time', 'valid_time')
+LAT_NAMES = ('latitude', 'lat')
+LON_NAMES = ('longitude', 'lon')
+DEPTH_NAMES = ('depth', 'lev')
+
+
+def find_coord(ds: xr.Dataset, candidates: Sequence[str]) -> Optional[str]:
+    """在数据集中查找第一个存在的坐标名"""
+    for name in candidates:
+        if name in ds.coords or name in ds.dims:
+            return name
+    return None
+
+
+def _range_slice(values: np.ndarray, lower: float, upper: float) -> slice:
+    """按坐标方向（升序/降序）构造闭区间切片"""
+    if values.size > 1 and values[0] > values[-1]:
+        return slice(upper, lower)
+    return slice(lower, upper)
+
+
+def _lon_bounds(lon: np.ndarray, lon_min: float, lon_max: float) -> Tuple[float, float]:
+    """将查询经度换算到文件的经度约定（0~360 或 -180~180）"""
+    if lon.size and lon.max() > 180:
+        lon_min, lon_max = lon_min % 360, lon_max % 360
+        if lon_max == 0 and lon_min >= 0:
+            lon_max = 360
+    else:
+        lon_min = lon_min - 360 if lon_min > 180 else lon_min
+        lon_max = lon_max - 360 if lon_max > 180 else lon_max
+    return lon_min, lon_max
+
+
+def _lon_indexer(lon: np.ndarray, lon_min: float, lon_max: float):
+    """经度选择，兼容 0~360 与 -180~180 两种约定及跨经线区间"""
+    lon_min, lon_max = _lon_bounds(lon, lon_min, lon_max)
+    if lon_min <= lon_max:
+        mask = (lon >= lon_min) & (lon <= lon_max)
+    else:
+        mask = (lon >= lon_min) | (lon <= lon_max)
+    return np.nonzero(mask)[0]
+
+
+def _covers(values: np.ndarray, lower: float, upper: float) -> bool:
+    """坐标是否覆盖 [lower, upper]，两端各放宽一个网格步长"""
+    values = np.sort(np.asarray(values, dtype='f8').ravel())
+    if values.size == 0:
+        return False
+    low_step = values[1] - values[0] if values.size > 1 else 0
+    high_step = values[-1] - values[-2] if values.size > 1 else 0
+    return lower >= values[0] - low_step and upper <= values[-1] + high_step
+
+
+def _lon_covers(lon: np.ndarray, lon_min: float, lon_max: float) -> bool:
+    """经度是否覆盖查询区间；全球网格总是覆盖"""
+    values = np.sort(np.asarray(lon, dtype='f8').ravel())
+    if values.size > 1:
+        step = float(np.median(np.diff(values)))
+        if values[-1] - values[0] + step >= 360 - 1e-6:
+            return True
+    if lon_max - lon_min >= 360:
+        return False
+    lon_min, lon_max = _lon_bounds(values, lon_min, lon_max)
+    # 跨越文件经度约定接缝的区间不可能由非全球的文件覆盖
+    return lon_min <= lon_max and _covers(values, lon_min, lon_max)
+
+
+def coverage_shortfall(ds: xr.Dataset,
+                       variables: Optional[List[str]] = None,
+                       spatial_range: Optional[Sequence[float]] = None,
+                       depth_range: Optional[Sequence[float]] = None) -> Optional[str]:
+    """检查文件的变量、空间与深度范围是否覆盖查询，返回缺少的内容（覆盖时为 None）"""
+    if variables:
+        missing = [v for v in variables if v not in ds.data_vars]
+        if missing:
+            return f"变量 {missing}"
+    if spatial_range:
+        lon_name = find_coord(ds, LON_NAMES)
+        lat_name = find_coord(ds, LAT_NAMES)
+        if lat_name and not _covers(ds[lat_name].values, spatial_range[2], spatial_range[3]):
+            return f"纬度范围 [{spatial_range[2]}, {spatial_range[3]}]"
+        if lon_name and not _lon_covers(ds[lon_name].values, spatial_range[0], spatial_range[1]):
+            return f"经度范围 [{spatial_range[0]}, {spatial_range[1]}]"
+    depth_name = find_coord(ds, DEPTH_NAMES)
+    if depth_range and depth_name and not _covers(ds[depth_name].values,
+                                                  depth_range[0], depth_range[1]):
+        return f"深度范围 [{depth_range[0]}, {depth_range[1]}]"
+    return None
+
+
+def _merge_gaps(gaps: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """合并重叠或相邻的闭区间缺口"""
+    merged: List[Tuple[datetime, datetime]] = []
+    for gap_start, gap_end in sorted(gaps):
+        if merged and gap_start <= merged[-1][1] + timedelta(seconds=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], gap_end))
+        else:
+            merged.append((gap_start, gap_end))
+    return merged
+
+
+def subset_dataset(ds: xr.Dataset,
+                   variables: Optional[List[str]] = None,
+                   start_datetime: Optional[datetime] = None,
+                   end_datetime: Optional[datetime] = None,
+                   spatial_range: Optional[Sequence[float]] = None,
+                   depth_range: Optional[Sequence[float]] = None) -> xr.Dataset:
+    """对已打开（惰性）的数据集做切片，不触发整体读取"""
+    if variables:
+        missing = [v for v in variables if v not in ds.data_vars]
+        if missing:
+            logger.warning(f"归档文件缺少变量 {missing}")
+        ds = ds[[v for v in variables if v in ds.data_vars]]
+
+    time_name = find_coord(ds, TIME_NAMES)
+    if time_name and (start_datetime or end_datetime):
+        ds = ds.sel({time_name: slice(start_datetime, end_datetime)})
+
+    if spatial_range:
+        lon_name = find_coord(ds, LON_NAMES)
+        lat_name = find_coord(ds, LAT_NAMES)
+        if lat_name:
+            ds = ds.sel({lat_name: _range_slice(ds[lat_name].values,
+                                                spatial_range[2], spatial_range[3])})
+        if lon_name:
+            ds = ds.isel({lon_name: _lon_indexer(ds[lon_name].values,
+                                                 spatial_range[0], spatial_range[1])})
+
+    depth_name = find_coord(ds, DEPTH_NAMES)
+    if depth_range and depth_name:
+        ds = ds.sel({depth_name: _range_slice(ds[depth_name].values,
+                                              depth_range[0], depth_range[1])})
+
+    return ds
+
+
+class LocalSubsetter:
+    """基于归档索引的本地子集查询
+
+    查询参数与 CMEMSDownloader.download_single 保持一致：
+    variables / start_datetime / end_datetime / spatial_range / depth_range。
+    """
+
+    def __init__(self, config: Dict[str, Any], allow_download: bool = True):
+        self.config = config
+        general_cfg = config.get('general', {})
+        self.output_dir = Path(config.get('output_base_dir')
+                               or general_cfg.get('output_base_dir', './data'))
+        self.cache_dir = self.output_dir / '.subset_cache'
+        self.index = ArchiveIndex(self.output_dir)
+        self.allow_download = allow_download
+        self._downloaders: Dict[str, Any] = {}
+
+    def _service_of(self, dataset_name: str) -> str:
+        for service in ('cmems', 'c3s'):
+            if dataset_name in self.config.get(service, {}).get('datasets', {}):
+                return service
+        raise ValueError(f"未知数据集: {dataset_name}")
+
+    def _get_downloader(self, service: str):
+        if service not in self._downloaders:
+            if service == 'cmems':
+                from downloaders.cmems_downloader import CMEMSDownloader
+                downloader = CMEMSDownloader(self.config)
+            else:
+                from downloaders.c3s_downloader import C3SDownloader
+                downloader = C3SDownloader(self.config)
+            if not downloader.connect():
+                raise RuntimeError(f"无法连接到 {service} 服务")
+            self._downloaders[service] = downloader
+        return self._downloaders[service]
+
+    def _cache_path(self, dataset_name: str, start: datetime, end: datetime,
+                    params: Dict[str, Any]) -> Path:
+        key = repr(sorted((k, str(v)) for k, v in params.items()))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]
+        return self.cache_dir / (f"{dataset_name}_{start:%Y%m%dT%H%M}_"
+                                 f"{end:%Y%m%dT%H%M}_{digest}.nc")
+
+    def _fetch_gap(self, dataset_name: str, start: datetime, end: datetime,
+                   variables: Optional[List[str]],
+                   spatial_range: Optional[Sequence[float]],
+                   depth_range: Optional[Sequence[float]]) -> List[Path]:
+        """从网络下载归档未覆盖的时间段（仅请求所需区域）"""
+        service = self._service_of(dataset_name)
+        downloader = self._get_downloader(service)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        requests: List[Tuple[Dict[str, Any], Path]] = []
+        base = {
+            'dataset_name': dataset_name,
+            'variables': variables,
+            'spatial_range': list(spatial_range) if spatial_range else None,
+        }
+
+        if service == 'cmems':
+            params = dict(base, start_datetime=start, end_datetime=end,
+                          depth_range=list(depth_range) if depth_range else None,
+                          force_download=False)
+            requests.append((params, self._cache_path(dataset_name, start, end, base)))
+        else:
+            # CDS 按月请求，日数据附带 day 列表
+            dataset_cfg = downloader.service_config['datasets'][dataset_name]
+            is_monthly = str(dataset_cfg.get('product_type', '')).startswith('monthly')
+            month_start = datetime(start.year, start.month, 1)
+            while month_start <= end:
+                if month_start.month == 12:
+                    next_month = datetime(month_start.year + 1, 1, 1)
+                else:
+                    next_month = datetime(month_start.year, month_start.month + 1, 1)
+                params = dict(base, year=month_start.year, month=month_start.month)
+                piece_start = max(start, month_start)
+                piece_end = min(end, next_month - timedelta(seconds=1))
+                if not is_monthly:
+                    params['day'] = list(range(piece_start.day, piece_end.day + 1))
+                requests.append((params, self._cache_path(dataset_name, piece_start,
+                                                          piece_end, base)))
+                month_start = next_month
+
+        paths = []
+        for params, path in requests:
+            if downloader.check_existing(path) or downloader.download_with_retry(params, path):
+                paths.append(path)
+            else:
+                logger.error(f"缺口下载失败: {dataset_name} {start} ~ {end}")
+        return paths
+
+    def subset(self, dataset_name: str,
+               start_datetime: datetime,
+               end_datetime: datetime,
+               variables: Optional[List[str]] = None,
+               spatial_range: Optional[Sequence[float]] = None,
+               depth_range: Optional[Sequence[float]] = None,
+               output_path: Optional[Path] = None) -> xr.Dataset:
+        """查询子集，返回拼接后的数据集；给定 output_path 时同时写出 NetCDF"""
+        if end_datetime < start_datetime:
+            raise ValueError("end_datetime 不能早于 start_datetime")
+
+        self.index.refresh()
+        gaps = self.index.coverage_gaps(dataset_name, start_datetime, end_datetime)
+
+        # 归档文件惰性打开；变量、空间或深度范围不足的文件所在时间段按缺口处理
+        datasets = []
+        shortfalls = []
+        for path, file_start, file_end in self.index.query(dataset_name, start_datetime,
+                                                           end_datetime):
+            ds = xr.open_dataset(path)
+            shortfall = coverage_shortfall(ds, variables, spatial_range, depth_range)
+            if shortfall is None:
+                datasets.append(ds)
+                continue
+            ds.close()
+            logger.info(f"{path.name} 未覆盖查询的{shortfall}，按缺口处理")
+            shortfalls.append(shortfall)
+            gaps.append((max(file_start, start_datetime),
+                         min(file_end - timedelta(seconds=1), end_datetime)))
+        gaps = _merge_gaps(gaps)
+
+        if gaps:
+            if self.allow_download:
+                for gap_start, gap_end in gaps:
+                    logger.info(f"归档缺口，回退到网络下载: {gap_start} ~ {gap_end}")
+                    for path in self._fetch_gap(dataset_name, gap_start, gap_end,
+                                                variables, spatial_range, depth_range):
+                        datasets.append(xr.open_dataset(path))
+            elif shortfalls:
+                for ds in datasets:
+                    ds.close()
+                raise ValueError(f"归档文件未覆盖查询的{shortfalls[0]}，且未允许网络下载: "
+                                 f"{dataset_name}")
+            else:
+                logger.warning(f"归档未覆盖 {len(gaps)} 个时间段，已跳过网络下载")
+
+        if not datasets:
+            raise FileNotFoundError(f"没有可用数据: {dataset_name} "
+                                    f"{start_datetime} ~ {end_datetime}")
+
+        # 每个文件先切片，拼接时只读取所需的数据块
+        parts = []
+        for ds in datasets:
+            part = subset_dataset(ds, variables, start_datetime, end_datetime,
+                                  spatial_range, depth_range)
+            time_name = find_coord(part, TIME_NAMES)
+            if time_name is None or part.sizes.get(time_name, 0) > 0:
+                parts.append(part)
+
+        if not parts:
+            raise FileNotFoundError(f"归档文件中没有落在查询范围内的时间步: {dataset_name}")
+
+        time_name = find_coord(parts[0], TIME_NAMES)
+        if len(parts) == 1 or time_name is None:
+            result = parts[0].load()
+        else:
+            result = xr.concat(parts, dim=time_name, data_vars='minimal',
+                               coords='minimal', compat='override')
+            result = result.sortby(time_name)
+            _, unique_idx = np.unique(result[time_name].values, return_index=True)
+            result = result.isel({time_name: unique_idx}).load()
+
+        for ds in datasets:
+            ds.close()
+
+        empty = [name for name in (find_coord(result, LAT_NAMES), find_coord(result, LON_NAMES),
+                                   find_coord(result, DEPTH_NAMES))
+                 if name and result.sizes.get(name, 1) == 0]
+        if empty:
+            raise ValueError(f"查询范围内没有数据（{empty} 为空）: {dataset_name}")
+
+        if output_path:
+            output_path = Path(output_path)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            result.to_netcdf(output_path)
+            logger.info(f"✅ 子集已写出: {output_path}")
+
+        return result
+
+
+def local_subset(config: Dict[str, Any], dataset_name: str,
+                 start_datetime: datetime, end_datetime: datetime,
+                 variables: Optional[List[str]] = None,
+                 spatial_range: Optional[Sequence[float]] = None,
+                 depth_range: Optional[Sequence[float]] = None,
+                 output_path: Optional[Path] = None,
+                 allow_download: bool = True) -> xr.Dataset:
+    """便捷函数：从本地归档查询子集"""
+    subsetter = LocalSubsetter(config, allow_download=allow_download)
+    return subsetter.subset(dataset_name, start_datetime, end_datetime,
+                            variables=variables, spatial_range=spatial_range,
+                            depth_range=depth_range, output_path=output_path)
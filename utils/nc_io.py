@@ -0,0 +1,136 @@
+"""
+NetCDF 流式读写工具：按内存上限分块复制变量，统一输出编码
+"""
+import itertools
+import logging
+from typing import Dict, Any, Iterator, Optional, Sequence, Tuple
+
+import netCDF4
+
+logger = logging.getLogger(__name__)
+
+TIME_DIM_NAMES = ('time', 'valid_time')
+
+
+def iter_slabs(shape: Sequence[int], itemsize: int,
+               max_bytes: int) -> Iterator[Tuple[slice, ...]]:
+    """将数组按前导维切成不超过 max_bytes 的块，逐块产出索引"""
+    shape = tuple(int(n) for n in shape)
+    if not shape:
+        yield ()
+        return
+
+    trailing = itemsize
+    split_axis = None
+    for axis in range(len(shape) - 1, -1, -1):
+        block = trailing * shape[axis]
+        if block > max_bytes:
+            split_axis = axis
+            break
+        trailing = block
+
+    if split_axis is None:
+        yield tuple(slice(None) for _ in shape)
+        return
+
+    step = max(1, max_bytes // trailing)
+    tail = tuple(slice(None) for _ in shape[split_axis + 1:])
+    for lead in itertools.product(*(range(n) for n in shape[:split_axis])):
+        head = tuple(slice(i, i + 1) for i in lead)
+        for start in range(0, shape[split_axis], step):
+            stop = min(start + step, shape[split_axis])
+            yield head + (slice(start, stop),) + tail
+
+
+def find_time_dim(ds: netCDF4.Dataset) -> Optional[str]:
+    """优先使用无限维，其次按常见时间维名查找"""
+    for name, dim in ds.dimensions.items():
+        if dim.isunlimited():
+            return name
+    for name in TIME_DIM_NAMES:
+        if name in ds.dimensions:
+            return name
+    return None
+
+
+def encoding_kwargs(var: netCDF4.Variable, dim_sizes: Dict[str, int],
+                    chunks: Optional[Dict[str, int]] = None,
+                    compression: Optional[str] = 'zlib',
+                    complevel: int = 4,
+                    shuffle: bool = True) -> Dict[str, Any]:
+    """根据维度名构造 createVariable 的分块/压缩参数
+
+    chunks 以维度名为键，未列出的维度取完整长度；无限维默认分块为 1。
+    """
+    kwargs: Dict[str, Any] = {}
+    if var.dimensions and chunks is not None:
+        chunksizes = []
+        for dim in var.dimensions:
+            size = dim_sizes[dim]
+            chunk = chunks.get(dim)
+            if size == 0:
+                chunksizes.append(max(1, int(chunk or 1)))
+            else:
+                chunksizes.append(max(1, min(int(chunk or size), size)))
+        kwargs['chunksizes'] = chunksizes
+    if compression and var.dimensions and var.dtype != str:
+        kwargs['compression'] = compression
+        kwargs['complevel'] = complevel
+        kwargs['shuffle'] = shuffle
+    return kwargs
+
+
+def create_like(src: netCDF4.Dataset, dst: netCDF4.Dataset,
+                unlimited_dim: Optional[str] = None,
+                chunks: Optional[Dict[str, int]] = None,
+                compression: Optional[str] = 'zlib',
+                complevel: int = 4,
+                shuffle: bool = True) -> None:
+    """按源文件结构创建目标文件的维度、变量和属性（不复制数据）"""
+    dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+
+    dim_sizes: Dict[str, int] = {}
+    for name, dim in src.dimensions.items():
+        if name == unlimited_dim or (unlimited_dim is None and dim.isunlimited()):
+            size = 0
+        else:
+            size = len(dim)
+        dst.createDimension(name, size or None)
+        dim_sizes[name] = size
+
+    for name, var in src.variables.items():
+        fill_value = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+        kwargs = encoding_kwargs(var, dim_sizes, chunks, compression, complevel, shuffle)
+        out = dst.createVariable(name, var.datatype, var.dimensions,
+                                 fill_value=fill_value, **kwargs)
+        out.setncatts({k: var.getncattr(k) for k in var.ncattrs() if k != '_FillValue'})
+        # 新建变量不继承数据集级设置，需单独关闭以按原始打包值写入
+        out.set_auto_maskandscale(False)
+
+
+def copy_variable(src_var: netCDF4.Variable, dst_var: netCDF4.Variable,
+                  max_bytes: int, axis: Optional[int] = None,
+                  offset: int = 0, skip: int = 0) -> None:
+    """分块复制变量数据；axis/offset 指定目标中沿某一维的写入偏移，skip 跳过源数据沿该维的前若干步"""
+    itemsize = src_var.dtype.itemsize if src_var.dtype != str else 64
+    shape = list(src_var.shape)
+    if axis is not None:
+        shape[axis] -= skip
+    for index in iter_slabs(shape, itemsize, max_bytes):
+        if axis is None:
+            dst_var[index] = src_var[index]
+            continue
+        source, target = list(index), list(index)
+        local = index[axis]
+        start = local.start or 0
+        stop = local.stop if local.stop is not None else shape[axis]
+        source[axis] = slice(skip + start, skip + stop)
+        target[axis] = slice(offset + start, offset + stop)
+        dst_var[tuple(target)] = src_var[tuple(source)]
+
+
+def open_raw(path, mode: str = 'r', **kwargs) -> netCDF4.Dataset:
+    """打开文件并关闭自动掩码/缩放，保证原样复制打包数据"""
+    ds = netCDF4.Dataset(path, mode, **kwargs)
+    ds.set_auto_maskandscale(False)
+    return ds
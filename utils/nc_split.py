@@ -0,0 +1,76 @@
+"""
+批量请求结果的拼接与拆分：按变量组/空间条带下载的分片合并后，再按时间窗口写回逐个归档文件
+"""
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import xarray as xr
+
+from utils.local_subset import LAT_NAMES, TIME_NAMES, find_coord
+
+logger = logging.getLogger(__name__)
+
+# 这些编码项与原文件的形状相关，拆分后的文件需由 netCDF 库重新确定
+_SHAPE_ENCODINGS = ('chunksizes', 'contiguous', 'original_shape', 'preferred_chunks',
+                    'source', 'unlimited_dims')
+
+
+def combine_parts(parts: List[List[Path]]) -> Tuple[xr.Dataset, List[xr.Dataset]]:
+    """拼接分片：parts[变量组][纬度条带]，返回合并结果与需在使用后关闭的源数据集
+
+    同一变量组的各条带沿纬度拼接（边界处重复的纬度行去重），各变量组再按变量合并。
+    """
+    groups = []
+    sources: List[xr.Dataset] = []
+    for bands in parts:
+        datasets = [xr.open_dataset(path) for path in bands]
+        sources.extend(datasets)
+        if len(datasets) == 1:
+            groups.append(datasets[0])
+            continue
+        lat_name = find_coord(datasets[0], LAT_NAMES)
+        combined = xr.concat(datasets, dim=lat_name, data_vars='minimal',
+                             coords='minimal', compat='override')
+        descending = datasets[0][lat_name].size > 1 and \
+            float(datasets[0][lat_name][0]) > float(datasets[0][lat_name][-1])
+        combined = combined.drop_duplicates(lat_name).sortby(lat_name, ascending=not descending)
+        groups.append(combined)
+    if len(groups) == 1:
+        return groups[0], sources
+    return xr.merge(groups, compat='override', combine_attrs='override'), sources
+
+
+def _encoding(ds: xr.Dataset) -> Dict[str, Dict]:
+    encoding = {}
+    for name, var in ds.variables.items():
+        encoding[name] = {key: value for key, value in var.encoding.items()
+                          if key not in _SHAPE_ENCODINGS}
+    return encoding
+
+
+def split_by_time(ds: xr.Dataset,
+                  windows: List[Tuple[datetime, datetime, Path]]) -> Dict[str, bool]:
+    """将数据集按 [start, end) 时间窗口写入各自的输出文件"""
+    time_name = find_coord(ds, TIME_NAMES)
+    if time_name is None:
+        raise ValueError("批量结果中没有时间坐标，无法拆分")
+    times = ds[time_name].values
+    encoding = _encoding(ds)
+
+    results: Dict[str, bool] = {}
+    for start, end, output_path in windows:
+        mask = (times >= np.datetime64(start)) & (times < np.datetime64(end))
+        if not mask.any():
+            logger.error(f"批量结果中没有 {start:%Y-%m-%d %H:%M} 的数据: {output_path}")
+            results[str(output_path)] = False
+            continue
+        piece = ds.isel({time_name: np.nonzero(mask)[0]})
+        tmp_path = output_path.with_suffix('.nc.tmp')
+        piece.to_netcdf(tmp_path, encoding=encoding)
+        os.replace(tmp_path, output_path)
+        results[str(output_path)] = True
+    return results
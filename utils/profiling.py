@@ -0,0 +1,215 @@
+"""
+性能剖析：按阶段记录耗时区间、cProfile 与 tracemalloc 快照，并输出火焰图兼容文件
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Profiler:
+    """分阶段剖析器
+
+    - 每个阶段记录墙钟区间（进程/线程归属），嵌套阶段形成调用栈
+    - cProfile 按阶段独占计时：进入子阶段时暂停父阶段的剖析
+    - tracemalloc 对每个线程的最外层阶段做前后快照比较；快照开销较大，只对
+      memory_phases 中的阶段（None 为全部）每 memory_every 次取样一次，
+      差异立即累加到各阶段的汇总中，内存占用不随任务数增长
+    输出：trace.json（Chrome/Perfetto/speedscope）、phases.folded（flamegraph.pl）、
+    各阶段 .pstats 与 summary.txt（Top-N 热点）。
+    """
+
+    def __init__(self, output_dir: Path, use_cprofile: bool = True,
+                 use_tracemalloc: bool = True, top_n: int = 20,
+                 memory_phases: Optional[Iterable[str]] = None, memory_every: int = 10):
+        self.output_dir = Path(output_dir) / datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.use_cprofile = use_cprofile
+        self.use_tracemalloc = use_tracemalloc
+        self.top_n = top_n
+        self.spans: List[Dict[str, Any]] = []
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.memory_phases = set(memory_phases) if memory_phases is not None else None
+        self.memory_every = max(1, int(memory_every))
+        # 各阶段按代码行累计的内存变化与取样次数
+        self.memory: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.memory_samples: Dict[str, int] = defaultdict(int)
+        self._occurrences: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        if use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+
+    def _stack(self) -> List[Any]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _start_profile(self, name: str) -> Optional[cProfile.Profile]:
+        if not self.use_cprofile:
+            return None
+        with self._lock:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+        try:
+            profile.enable()
+        except ValueError:
+            # 其他线程已有活动的剖析器（Python 3.12+ 仅允许一个）
+            return None
+        return profile
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录一个阶段"""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent and parent['profile'] is not None:
+            parent['profile'].disable()
+
+        frame = {
+            'name': name,
+            'path': (parent['path'] + [name]) if parent else [name],
+            'profile': None,
+            'snapshot': None,
+        }
+        # 先取快照再开启剖析，避免快照开销计入阶段
+        if self.use_tracemalloc and not stack and self._sample_memory(name):
+            frame['snapshot'] = tracemalloc.take_snapshot()
+        frame['profile'] = self._start_profile(name)
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if frame['profile'] is not None:
+                frame['profile'].disable()
+            stack.pop()
+
+            thread = threading.current_thread()
+            span = {
+                'name': name,
+                'path': frame['path'],
+                'start': start - self._origin,
+                'duration': end - start,
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'thread': thread.name,
+            }
+            if frame['snapshot'] is not None:
+                diff = tracemalloc.take_snapshot().compare_to(frame['snapshot'], 'lineno')
+                span['memory_delta'] = sum(stat.size_diff for stat in diff)
+                with self._lock:
+                    merged = self.memory[name]
+                    for stat in diff:
+                        if stat.size_diff:
+                            merged[str(stat.traceback[0])] += stat.size_diff
+                    self.memory_samples[name] += 1
+            with self._lock:
+                self.spans.append(span)
+
+            if parent and parent['profile'] is not None:
+                try:
+                    parent['profile'].enable()
+                except ValueError:
+                    parent['profile'] = None
+
+    def _sample_memory(self, name: str) -> bool:
+        """本次阶段是否做内存快照：首次及此后每 memory_every 次"""
+        if self.memory_phases is not None and name not in self.memory_phases:
+            return False
+        with self._lock:
+            count = self._occurrences[name]
+            self._occurrences[name] += 1
+        return count % self.memory_every == 0
+
+    def _write_trace(self) -> Path:
+        path = self.output_dir / 'trace.json'
+        events = [{
+            'name': span['name'],
+            'ph': 'X',
+            'ts': span['start'] * 1e6,
+            'dur': span['duration'] * 1e6,
+            'pid': span['pid'],
+            'tid': span['tid'],
+            'args': {'thread': span['thread'], 'memory_delta': span.get('memory_delta')},
+        } for span in self.spans]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+    def _write_folded(self) -> Path:
+        """折叠栈格式，每行为 “进程;线程;阶段;子阶段 自身微秒数”"""
+        child_time: Dict[tuple, float] = defaultdict(float)
+        totals: Dict[tuple, float] = defaultdict(float)
+        for span in self.spans:
+            key = (span['pid'], span['thread'], tuple(span['path']))
+            totals[key] += span['duration']
+            if len(span['path']) > 1:
+                parent = (span['pid'], span['thread'], tuple(span['path'][:-1]))
+                child_time[parent] += span['duration']
+
+        path = self.output_dir / 'phases.folded'
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, total in sorted(totals.items()):
+                self_us = int(max(total - child_time.get(key, 0.0), 0) * 1e6)
+                if self_us:
+                    pid, thread, names = key
+                    f.write(f"pid-{pid};{thread};{';'.join(names)} {self_us}\n")
+        return path
+
+    def _write_summary(self) -> Path:
+        lines = ["==== 阶段耗时 ===="]
+        stats_by_phase: Dict[str, List[float]] = defaultdict(list)
+        for span in self.spans:
+            stats_by_phase['/'.join(span['path'])].append(span['duration'])
+        lines.append(f"{'phase':<48}{'count':>8}{'total_s':>12}{'mean_ms':>12}")
+        for name, durations in sorted(stats_by_phase.items(),
+                                      key=lambda item: -sum(item[1])):
+            lines.append(f"{name:<48}{len(durations):>8}{sum(durations):>12.3f}"
+                         f"{sum(durations) / len(durations) * 1000:>12.2f}")
+
+        for name, profile in self.profiles.items():
+            stats_path = self.output_dir / f"{name}.pstats"
+            try:
+                profile.dump_stats(str(stats_path))
+                buffer = io.StringIO()
+                pstats.Stats(profile, stream=buffer).sort_stats('cumulative').print_stats(self.top_n)
+            except TypeError:
+                # 阶段内没有采到任何调用
+                continue
+            lines.append(f"\n==== {name} 热点 (cumulative, Top {self.top_n}) ====")
+            lines.append(buffer.getvalue().strip())
+
+        for name, merged in self.memory.items():
+            top = sorted(merged.items(), key=lambda item: -abs(item[1]))[:self.top_n]
+            lines.append(f"\n==== {name} 内存变化 (Top {self.top_n}，"
+                         f"{self.memory_samples[name]} 次取样累计) ====")
+            lines.extend(f"{size / 1024:>12.1f} KiB  {where}" for where, size in top)
+
+        path = self.output_dir / 'summary.txt'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def write_report(self) -> Path:
+        """写出全部剖析结果，返回输出目录"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._write_trace()
+        self._write_folded()
+        summary = self._write_summary()
+        if self.use_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        logger.info(f"剖析结果已写出: {self.output_dir} (摘要: {summary.name})")
+        return self.output_dir
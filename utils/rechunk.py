@@ -0,0 +1,140 @@
+"""
+归档重分块/重压缩：按数据集配置的分块形状与压缩参数重写 NetCDF 文件
+"""
+import logging
+import os
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import netCDF4
+
+from utils.archive_index import ArchiveIndex
+from utils.nc_io import copy_variable, create_like, open_raw
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS: Dict[str, Any] = {
+    'chunks': None,
+    'compression': 'zlib',
+    'complevel': 4,
+    'shuffle': True,
+    'max_memory_mb': 256,
+    'workers': 2,
+}
+
+SUPPORTED_COMPRESSION = ('zlib', 'zstd', None)
+
+
+def check_compression(compression: Optional[str]) -> None:
+    """检查压缩算法在当前 netCDF4 构建中是否可用"""
+    if compression not in SUPPORTED_COMPRESSION:
+        raise ValueError(f"不支持的压缩算法: {compression}")
+    if compression == 'zstd' and not getattr(netCDF4, '__has_zstandard_support__', False):
+        raise ValueError("当前 netCDF4 构建不支持 zstd 压缩")
+
+
+def dataset_options(config: Dict[str, Any], dataset_name: str) -> Dict[str, Any]:
+    """合并 processing.rechunk 的全局参数与数据集级参数"""
+    rechunk_cfg = dict(config.get('processing', {}).get('rechunk') or {})
+    per_dataset = (rechunk_cfg.pop('datasets', None) or {}).get(dataset_name) or {}
+    options = dict(DEFAULT_OPTIONS)
+    options.update(rechunk_cfg)
+    options.update(per_dataset)
+    return options
+
+
+def _layout_matches(path: Path, options: Dict[str, Any]) -> bool:
+    """判断文件是否已是目标布局（用于跳过重复处理）"""
+    chunks = options.get('chunks') or {}
+    with netCDF4.Dataset(path) as ds:
+        for var in ds.variables.values():
+            if not var.dimensions or var.dtype == str:
+                continue
+            filters = var.filters() or {}
+            compression = options.get('compression')
+            if compression and not filters.get(compression):
+                return False
+            if not compression and (filters.get('zlib') or filters.get('zstd')):
+                return False
+            if compression and filters.get('complevel') != options.get('complevel'):
+                return False
+            if chunks:
+                current = var.chunking()
+                if current == 'contiguous':
+                    return False
+                for dim, size in zip(var.dimensions, current):
+                    want = chunks.get(dim)
+                    if want and size != min(int(want), len(ds.dimensions[dim]) or int(want)):
+                        return False
+    return True
+
+
+def rechunk_file(src_path: Path, dst_path: Optional[Path] = None,
+                 options: Optional[Dict[str, Any]] = None) -> bool:
+    """重写单个文件；dst_path 为空时原地替换"""
+    opts = dict(DEFAULT_OPTIONS, **(options or {}))
+    src_path = Path(src_path)
+    target = Path(dst_path) if dst_path else src_path
+    tmp_path = target.with_suffix('.nc.tmp')
+    max_bytes = int(opts['max_memory_mb']) * 1024 * 1024
+
+    try:
+        check_compression(opts['compression'])
+        with open_raw(src_path) as src, open_raw(tmp_path, 'w', format='NETCDF4') as dst:
+            create_like(src, dst, chunks=opts['chunks'],
+                        compression=opts['compression'],
+                        complevel=opts['complevel'], shuffle=opts['shuffle'])
+            for name, var in src.variables.items():
+                out = dst.variables[name]
+                out.set_var_chunk_cache(size=min(max_bytes, 64 * 1024 * 1024))
+                copy_variable(var, out, max_bytes,
+                              axis=0 if var.dimensions else None)
+        os.replace(tmp_path, target)
+        logger.info(f"✅ 重写完成: {target}")
+        return True
+    except Exception as e:
+        logger.error(f"重写失败 {src_path}: {e}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return False
+
+
+def rechunk_archive(config: Dict[str, Any], dataset_name: str,
+                    options: Optional[Dict[str, Any]] = None,
+                    files: Optional[List[Path]] = None,
+                    force: bool = False) -> Dict[str, bool]:
+    """对数据集的全部归档文件原地重分块，进程池并行"""
+    opts = dataset_options(config, dataset_name)
+    opts.update(options or {})
+    check_compression(opts['compression'])
+
+    if files is None:
+        general_cfg = config.get('general', {})
+        output_dir = Path(config.get('output_base_dir')
+                          or general_cfg.get('output_base_dir', './data'))
+        index = ArchiveIndex(output_dir)
+        index.refresh()
+        files = [path for path, _, _ in
+                 index.query(dataset_name, datetime.min, datetime.max)]
+
+    results: Dict[str, bool] = {}
+    pending = []
+    for path in files:
+        if not force and _layout_matches(path, opts):
+            logger.info(f"⏭️ 布局已符合，跳过: {path}")
+            results[path.name] = True
+        else:
+            pending.append(path)
+
+    if not pending:
+        return results
+
+    with ProcessPoolExecutor(max_workers=int(opts['workers'])) as executor:
+        futures = {executor.submit(rechunk_file, path, None, opts): path for path in pending}
+        for current, future in enumerate(as_completed(futures), 1):
+            results[futures[future].name] = future.result()
+            logger.info(f"进度: {current}/{len(futures)} ({current / len(futures) * 100:.1f}%)")
+
+    return results
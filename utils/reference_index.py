@@ -0,0 +1,357 @@
+"""
+引用索引：扫描归档文件一次，记录每个变量分块在源文件中的字节范围（kerchunk 格式），
+之后无需读取各文件元数据即可将整个归档作为单个惰性数据集打开
+"""
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from utils.archive_index import ArchiveIndex, parse_archive_filename
+from utils.local_subset import DEPTH_NAMES, LAT_NAMES, LON_NAMES, TIME_NAMES
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+SIGNATURE_NAME = 'combined.signature.json'
+
+
+def reference_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    """processing.reference_index 中的参数"""
+    options = {'enabled': False, 'index_dir': None, 'inline_threshold': 500, 'workers': 2}
+    options.update(config.get('processing', {}).get('reference_index') or {})
+    return options
+
+
+def _output_base(config: Dict[str, Any]) -> Path:
+    general_cfg = config.get('general', {})
+    return Path(config.get('output_base_dir') or general_cfg.get('output_base_dir', './data'))
+
+
+def scan_file(path: Path, inline_threshold: int = 500) -> Dict[str, Any]:
+    """读取单个 NetCDF4/HDF5 文件的分块位置，返回 kerchunk 引用（在工作进程中执行）"""
+    from kerchunk.hdf import SingleHdf5ToZarr
+
+    # 引用中记录绝对路径，索引可在任意工作目录下打开
+    return SingleHdf5ToZarr(str(Path(path).resolve()),
+                            inline_threshold=inline_threshold).translate()
+
+
+def _select_files(entries: List[Tuple[Path, datetime, datetime]]) -> List[Path]:
+    """去掉时间范围被其他文件覆盖的文件（合并后的月/年文件优先）"""
+    ordered = sorted(entries, key=lambda item: (item[1], -(item[2] - item[1]).total_seconds()))
+    selected: List[Path] = []
+    covered_until: Optional[datetime] = None
+    for path, start, end in ordered:
+        if covered_until is not None and start < covered_until:
+            continue
+        selected.append(path)
+        covered_until = end
+    return selected
+
+
+class ReferenceIndex:
+    """单个数据集的引用索引
+
+    每个文件的引用按 (mtime, size) 缓存为 files/{文件名}.json，新增或修改的文件才重新扫描；
+    沿时间维合并后的结果写入 {数据集}.json。新文件的时间范围位于已合并范围之前或之后时，
+    只把新引用追加到已合并的索引中，不必重新合并全部文件；其他情况重新合并。
+    清单与合并索引的写入都在文件锁内进行。
+    """
+
+    def __init__(self, index_dir: Path, dataset_name: str, inline_threshold: int = 500):
+        self.dataset_name = dataset_name
+        self.index_dir = Path(index_dir) / dataset_name
+        self.files_dir = self.index_dir / 'files'
+        self.combined_path = self.index_dir / f"{dataset_name}.json"
+        self.inline_threshold = inline_threshold
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        self._load_manifest()
+
+    def _load_manifest(self) -> None:
+        """从磁盘重新读取清单（其他下载进程可能已登记新文件）"""
+        manifest_path = self.index_dir / MANIFEST_NAME
+        self.manifest = {}
+        if manifest_path.exists():
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    self.manifest = json.load(f)
+            except (OSError, ValueError):
+                logger.warning(f"引用索引清单损坏，将重新扫描: {manifest_path}")
+
+    def _save_manifest(self) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_dir / f"{MANIFEST_NAME}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.index_dir / MANIFEST_NAME)
+
+    def _ref_path(self, path: Path) -> Path:
+        return self.files_dir / f"{path.name}.json"
+
+    def is_current(self, path: Path) -> bool:
+        entry = self.manifest.get(str(path))
+        if entry is None or not self._ref_path(path).exists():
+            return False
+        stat = path.stat()
+        return entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size
+
+    def store(self, path: Path, refs: Dict[str, Any]) -> None:
+        """保存单个文件的引用"""
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        ref_path = self._ref_path(path)
+        tmp_path = ref_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(refs, f)
+        os.replace(tmp_path, ref_path)
+        stat = path.stat()
+        self.manifest[str(path)] = {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+    def add_file(self, path: Path) -> None:
+        """扫描并登记单个文件，同时更新已合并的索引（供下载完成后调用）
+
+        新文件位于已合并时间范围两端时直接追加；位于范围内部（补缺口、分布式节点
+        乱序完成、插队任务）或替换了已合并的文件时，重新合并全部文件。
+        """
+        path = Path(path)
+        self._load_manifest()
+        if self.is_current(path):
+            return
+        refs = scan_file(path, self.inline_threshold)
+        with self._lock():
+            # 锁内重新读取清单，避免覆盖其他下载进程刚登记的文件
+            self._load_manifest()
+            self.store(path, refs)
+            self._save_manifest()
+            if not self.combined_path.exists():
+                return
+            previous = self._load_signature()
+            if previous is None:
+                return
+            signature = [item for item in previous if item[0] != str(path)]
+            signature.append([str(path), self.manifest[str(path)]['mtime']])
+            if not self._try_append(previous, signature):
+                logger.info(f"{path.name} 位于已索引的时间范围内，重新合并引用索引")
+                signature = self._recombine([Path(item[0]) for item in signature])
+            self._save_signature(signature)
+
+    def _recombine(self, files: List[Path]) -> List[List[Any]]:
+        """按时间顺序重新合并仍然存在的已登记文件，返回新的签名"""
+        entries = []
+        for path in files:
+            span = parse_archive_filename(path.name)
+            if span is None or str(path) not in self.manifest or not path.exists():
+                continue
+            entries.append((path, span[1], span[2]))
+        indexed = _select_files(entries)
+        self._combine(indexed)
+        return [[str(path), self.manifest[str(path)]['mtime']] for path in indexed]
+
+    def _lock(self):
+        """合并索引的写锁，多个下载进程可同时登记文件"""
+        return _FileLock(self.index_dir / '.lock')
+
+    def _load_signature(self) -> Optional[List[List[Any]]]:
+        signature_path = self.index_dir / SIGNATURE_NAME
+        if not signature_path.exists():
+            return None
+        try:
+            return json.loads(signature_path.read_text(encoding='utf-8'))
+        except ValueError:
+            return None
+
+    def _save_signature(self, signature: List[List[Any]]) -> None:
+        tmp_path = self.index_dir / f"{SIGNATURE_NAME}.tmp"
+        tmp_path.write_text(json.dumps(signature), encoding='utf-8')
+        os.replace(tmp_path, self.index_dir / SIGNATURE_NAME)
+
+    def _try_append(self, previous: List[List[Any]], signature: List[List[Any]]) -> bool:
+        """已合并的文件均未变化、新文件整体位于已合并时间范围之前或之后时，增量追加"""
+        current = dict((path, mtime) for path, mtime in signature)
+        if any(current.get(path) != mtime for path, mtime in previous):
+            return False
+        added = [path for path in current if path not in dict(previous)]
+        if not previous or not added:
+            return False
+        spans = {path: parse_archive_filename(Path(path).name) for path in current}
+        if any(span is None for span in spans.values()):
+            return False
+        first = min(spans[path][1] for path, _ in previous)
+        last = max(spans[path][2] for path, _ in previous)
+        if not all(spans[path][1] >= last or spans[path][2] <= first for path in added):
+            return False
+
+        with open(self.combined_path, 'r', encoding='utf-8') as f:
+            combined = json.load(f)
+        self._combine([Path(path) for path in added], base=combined)
+        return True
+
+    def update(self, files: List[Path], workers: int = 2) -> Optional[Path]:
+        """扫描新增/修改的文件并重新合并，返回合并后的索引路径"""
+        self._load_manifest()
+        pending = [path for path in files if not self.is_current(path)]
+        stored: Dict[str, Dict[str, Any]] = {}
+        if pending:
+            logger.info(f"扫描 {len(pending)} 个新增/修改的文件 ({self.dataset_name})")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(scan_file, path, self.inline_threshold): path
+                           for path in pending}
+                for current, future in enumerate(as_completed(futures), 1):
+                    path = futures[future]
+                    try:
+                        self.store(path, future.result())
+                        stored[str(path)] = self.manifest[str(path)]
+                    except Exception as e:
+                        # 非 HDF5 文件（如 NetCDF3）无法建立引用
+                        logger.warning(f"无法建立引用，跳过 {path}: {e}")
+                    logger.info(f"进度: {current}/{len(futures)} "
+                                f"({current / len(futures) * 100:.1f}%)")
+
+        wanted = {str(path) for path in files}
+        with self._lock():
+            # 锁内合并磁盘上的清单（其他下载进程可能已登记新文件），只去掉已删除的文件
+            self._load_manifest()
+            self.manifest.update(stored)
+            self.manifest = {key: value for key, value in self.manifest.items()
+                             if key in wanted or Path(key).exists()}
+            self._save_manifest()
+
+            indexed = [path for path in files if str(path) in self.manifest]
+            if not indexed:
+                return None
+            signature = [[str(path), self.manifest[str(path)]['mtime']] for path in indexed]
+            previous = self._load_signature() if self.combined_path.exists() else None
+            if previous is not None and sorted(previous) == sorted(signature):
+                return self.combined_path
+            if previous is None or not self._try_append(previous, signature):
+                self._combine(indexed)
+            self._save_signature(signature)
+        return self.combined_path
+
+    def _combine(self, files: List[Path], base: Optional[Dict[str, Any]] = None) -> None:
+        """沿时间维合并各文件的引用；base 为已合并的索引时只追加 files"""
+        from kerchunk.combine import MultiZarrToZarr
+
+        refs = [base] if base is not None else []
+        for path in files:
+            with open(self._ref_path(path), 'r', encoding='utf-8') as f:
+                refs.append(json.load(f))
+
+        sample = refs[0]['refs']
+        names = {key.split('/')[0] for key in sample if '/' in key}
+        time_dim = next((name for name in TIME_NAMES if name in names), None)
+        if time_dim is None:
+            raise ValueError(f"{files[0]} 中没有时间坐标，无法沿时间合并")
+        identical = [name for name in LAT_NAMES + LON_NAMES + DEPTH_NAMES if name in names]
+
+        if len(refs) == 1:
+            combined = refs[0]
+        else:
+            # cf: 按各文件自身的单位解码时间后统一编码，时间值内联到索引中
+            combined = MultiZarrToZarr(refs, concat_dims=[time_dim], identical_dims=identical,
+                                       coo_map={time_dim: f"cf:{time_dim}"}).translate()
+            # 时间重复的记录（如 CMEMS 逐日文件中次日 00:00）在合并时去重；
+            # 时间维分块大于 1 时去重会使分块错位，读到错误的数据
+            total = sum(_time_layout(item, time_dim)[0] for item in refs)
+            length, _ = _time_layout(combined, time_dim)
+            chunk = max(_time_layout(item, time_dim)[1] for item in refs)
+            if length < total and chunk > 1:
+                raise ValueError(f"{self.dataset_name} 各文件的时间有重叠且时间维分块为 {chunk}，"
+                                 f"无法建立引用索引；请先用 consolidate.py 合并去重")
+
+        tmp_path = self.combined_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(combined, f)
+        os.replace(tmp_path, self.combined_path)
+        action = "追加" if base is not None else "合并"
+        logger.info(f"✅ 引用索引已{action}: {self.combined_path} ({len(files)} 个文件)")
+
+
+def _time_layout(refs: Dict[str, Any], time_dim: str) -> Tuple[int, int]:
+    """引用中时间维的长度与数据变量沿时间维的最大分块"""
+    def load(value: Any) -> Dict[str, Any]:
+        return json.loads(value) if isinstance(value, (str, bytes)) else value
+
+    items = refs['refs']
+    length = load(items[f"{time_dim}/.zarray"])['shape'][0]
+    chunk = 1
+    for key, value in items.items():
+        # 时间坐标本身由合并重新生成，不受分块影响
+        if not key.endswith('/.zarray') or key == f"{time_dim}/.zarray":
+            continue
+        attrs = load(items.get(key[:-len('.zarray')] + '.zattrs', '{}'))
+        dims = attrs.get('_ARRAY_DIMENSIONS', [])
+        if time_dim in dims:
+            chunk = max(chunk, load(value)['chunks'][dims.index(time_dim)])
+    return length, chunk
+
+
+class _FileLock:
+    """基于 flock 的排他锁（Windows 上不加锁）"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> '_FileLock':
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+
+
+def dataset_index(config: Dict[str, Any], dataset_name: str) -> ReferenceIndex:
+    options = reference_options(config)
+    index_dir = Path(options['index_dir'] or _output_base(config) / '.references')
+    return ReferenceIndex(index_dir, dataset_name, int(options['inline_threshold']))
+
+
+def build_reference_index(config: Dict[str, Any], dataset_name: str,
+                          workers: Optional[int] = None) -> Optional[Path]:
+    """为数据集的全部归档文件建立/增量更新引用索引"""
+    archive = ArchiveIndex(_output_base(config))
+    archive.refresh()
+    files = _select_files(archive.query(dataset_name, datetime.min, datetime.max))
+    options = reference_options(config)
+    return dataset_index(config, dataset_name).update(files, int(workers or options['workers']))
+
+
+def index_downloaded_file(config: Dict[str, Any], path: Path) -> None:
+    """下载完成后登记单个文件并更新合并索引（位于已索引范围两端时直接追加）"""
+    parsed = parse_archive_filename(Path(path).name)
+    if parsed:
+        dataset_index(config, parsed[0]).add_file(Path(path))
+
+
+def open_reference_dataset(config: Dict[str, Any], dataset_name: str,
+                           update: bool = False, **kwargs):
+    """将数据集的整个归档作为单个惰性 xarray 数据集打开
+
+    默认直接读取已合并的索引；update 为 True 时先扫描归档目录并增量更新索引
+    （需对每个文件做一次 stat，文件较多时耗时较长）。
+    """
+    import xarray as xr
+
+    index = dataset_index(config, dataset_name)
+    combined = build_reference_index(config, dataset_name) if update else index.combined_path
+    if combined is None or not Path(combined).exists():
+        raise FileNotFoundError(f"没有数据集 {dataset_name} 的引用索引")
+
+    backend_kwargs = {'consolidated': False,
+                      'storage_options': {'fo': str(combined), 'remote_protocol': 'file'}}
+    return xr.open_dataset('reference://', engine='zarr',
+                           backend_kwargs=backend_kwargs, **kwargs)
@@ -0,0 +1,313 @@
+"""
+规则经纬网格重插值：一次计算双线性/守恒权重，保存为稀疏矩阵并按网格哈希缓存
+"""
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import xarray as xr
+
+from utils.local_subset import LAT_NAMES, LON_NAMES, find_coord
+from utils.nc_io import iter_slabs
+
+logger = logging.getLogger(__name__)
+
+METHODS = ('bilinear', 'conservative')
+
+
+def grid_hash(lat: np.ndarray, lon: np.ndarray) -> str:
+    """网格坐标的哈希，用作权重缓存键"""
+    digest = hashlib.sha1()
+    for values in (lat, lon):
+        values = np.ascontiguousarray(values, dtype='f8')
+        digest.update(str(values.shape).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _is_periodic(lon: np.ndarray) -> bool:
+    if lon.size < 2:
+        return False
+    step = np.abs(np.diff(lon)).mean()
+    return abs((lon.max() - lon.min()) + step - 360) < step * 0.5
+
+
+def _linear_weights(src: np.ndarray, dst: np.ndarray, periodic: bool = False) -> sp.csr_matrix:
+    """一维线性插值权重矩阵 (len(dst), len(src))；超出源范围的目标行为空"""
+    order = np.argsort(src)
+    s = src[order].astype('f8')
+    t = dst.astype('f8')
+    index = order
+    if periodic:
+        t = (t - s[0]) % 360 + s[0]
+        s = np.append(s, s[0] + 360)
+        index = np.append(order, order[0])
+
+    right = np.searchsorted(s, t, side='right')
+    right = np.clip(right, 1, s.size - 1)
+    left = right - 1
+    span = s[right] - s[left]
+    frac = np.where(span > 0, (t - s[left]) / np.where(span > 0, span, 1), 0.0)
+    inside = (t >= s[0]) & (t <= s[-1])
+
+    rows = np.nonzero(inside)[0]
+    data = np.concatenate([1 - frac[rows], frac[rows]])
+    cols = np.concatenate([index[left[rows]], index[right[rows]]])
+    matrix = sp.csr_matrix((data, (np.concatenate([rows, rows]), cols)),
+                           shape=(dst.size, src.size))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _cell_bounds(centers: np.ndarray, lower: float, upper: float) -> np.ndarray:
+    """由中心点推算单元边界（升序）"""
+    c = np.sort(centers.astype('f8'))
+    mid = (c[:-1] + c[1:]) / 2
+    first = c[0] - (mid[0] - c[0]) if c.size > 1 else c[0] - 0.5
+    last = c[-1] + (c[-1] - mid[-1]) if c.size > 1 else c[-1] + 0.5
+    return np.clip(np.concatenate([[first], mid, [last]]), lower, upper)
+
+
+def _overlap_weights(src: np.ndarray, dst: np.ndarray, measure, lower: float,
+                     upper: float, periodic: bool = False) -> sp.csr_matrix:
+    """一维守恒权重：按单元重叠量加权，行归一化"""
+    src_order, dst_order = np.argsort(src), np.argsort(dst)
+    sb = measure(_cell_bounds(src, lower, upper))
+    db = measure(_cell_bounds(dst, lower, upper))
+    shifts = (-360.0, 0.0, 360.0) if periodic else (0.0,)
+
+    rows, cols, data = [], [], []
+    for shift in shifts:
+        s_lo, s_hi = sb[:-1] + shift, sb[1:] + shift
+        for j in range(dst.size):
+            overlap = np.minimum(s_hi, db[j + 1]) - np.maximum(s_lo, db[j])
+            hit = np.nonzero(overlap > 0)[0]
+            rows.extend([dst_order[j]] * hit.size)
+            cols.extend(src_order[hit])
+            data.extend(overlap[hit])
+
+    matrix = sp.csr_matrix((data, (rows, cols)), shape=(dst.size, src.size))
+    matrix.sum_duplicates()
+    row_sum = np.asarray(matrix.sum(axis=1)).ravel()
+    scale = np.divide(1.0, row_sum, out=np.zeros_like(row_sum), where=row_sum > 0)
+    return sp.csr_matrix(sp.diags(scale) @ matrix)
+
+
+def compute_weights(src_lat: np.ndarray, src_lon: np.ndarray,
+                    dst_lat: np.ndarray, dst_lon: np.ndarray,
+                    method: str = 'bilinear') -> sp.csr_matrix:
+    """二维权重矩阵 (ny_dst*nx_dst, ny_src*nx_src)，按纬度×经度可分离构造"""
+    if method not in METHODS:
+        raise ValueError(f"不支持的插值方法: {method}")
+    periodic = _is_periodic(np.asarray(src_lon))
+    if method == 'bilinear':
+        w_lat = _linear_weights(np.asarray(src_lat), np.asarray(dst_lat))
+        w_lon = _linear_weights(np.asarray(src_lon), np.asarray(dst_lon), periodic)
+    else:
+        # 纬向按 sin(φ) 度量保证面积守恒
+        w_lat = _overlap_weights(np.asarray(src_lat), np.asarray(dst_lat),
+                                 lambda b: np.sin(np.deg2rad(b)), -90, 90)
+        dst_lon = np.asarray(dst_lon)
+        if periodic:
+            # 目标经度平移到源经度区间附近，便于单元重叠计算
+            dst_lon = (dst_lon - src_lon.min()) % 360 + src_lon.min()
+        w_lon = _overlap_weights(np.asarray(src_lon), dst_lon, lambda b: b,
+                                 -np.inf, np.inf, periodic)
+    return sp.csr_matrix(sp.kron(w_lat, w_lon, format='csr'))
+
+
+class Regridder:
+    """源网格到目标网格的重插值器，权重按网格哈希缓存到磁盘"""
+
+    def __init__(self, src_lat: np.ndarray, src_lon: np.ndarray,
+                 dst_lat: np.ndarray, dst_lon: np.ndarray,
+                 method: str = 'bilinear',
+                 cache_dir: Optional[Path] = None,
+                 min_valid_weight: float = 0.5,
+                 max_memory_mb: float = 256):
+        self.src_shape = (len(src_lat), len(src_lon))
+        self.dst_lat = np.asarray(dst_lat)
+        self.dst_lon = np.asarray(dst_lon)
+        self.method = method
+        self.min_valid_weight = min_valid_weight
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+
+        key = f"{method}_{grid_hash(src_lat, src_lon)}_{grid_hash(dst_lat, dst_lon)}"
+        self.weights_path = Path(cache_dir) / f"{key}.npz" if cache_dir else None
+        if self.weights_path and self.weights_path.exists():
+            self.weights = sp.load_npz(self.weights_path).tocsr()
+            logger.info(f"加载缓存权重: {self.weights_path}")
+        else:
+            self.weights = compute_weights(src_lat, src_lon, dst_lat, dst_lon, method)
+            if self.weights_path:
+                self.weights_path.parent.mkdir(parents=True, exist_ok=True)
+                sp.save_npz(self.weights_path, self.weights)
+                logger.info(f"权重已缓存: {self.weights_path}")
+
+    def _field_bytes(self) -> int:
+        """单个二维场的工作内存：源场的 float64 副本、填充值与有效掩码，以及目标场的分子与权重和"""
+        n_src = self.src_shape[0] * self.src_shape[1]
+        n_dst = len(self.dst_lat) * len(self.dst_lon)
+        return 3 * 8 * n_src + 3 * 8 * n_dst
+
+    def regrid_array(self, data: np.ndarray) -> np.ndarray:
+        """对最后两维为 (lat, lon) 的数组做稀疏矩阵乘，前导维按内存上限分批处理
+
+        缺测值（如陆地）不参与加权，有效权重之和低于 min_valid_weight 的目标点置为 NaN。
+        """
+        lead = data.shape[:-2]
+        flat = np.asarray(data).reshape(-1, self.src_shape[0] * self.src_shape[1])
+        total = np.asarray(self.weights.sum(axis=1)).ravel()
+        result = np.empty((flat.shape[0], len(self.dst_lat) * len(self.dst_lon)),
+                          dtype=np.result_type(flat.dtype, np.float32))
+        step = max(1, self.max_bytes // self._field_bytes())
+        for start in range(0, flat.shape[0], step):
+            block = flat[start:start + step].astype('f8')
+            valid = np.isfinite(block)
+            block[~valid] = 0.0
+
+            numerator = (self.weights @ block.T).T
+            weight_sum = (self.weights @ valid.T.astype('f8')).T
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = numerator / weight_sum
+            values[(weight_sum < self.min_valid_weight * total) | (total == 0)] = np.nan
+            result[start:start + step] = values
+        return result.reshape(lead + (len(self.dst_lat), len(self.dst_lon)))
+
+    def regrid_dataset(self, ds: xr.Dataset) -> xr.Dataset:
+        """重插值数据集中所有以 (lat, lon) 结尾的变量，其余变量保持不变"""
+        lat_name, lon_name = find_coord(ds, LAT_NAMES), find_coord(ds, LON_NAMES)
+        if lat_name is None or lon_name is None:
+            raise ValueError("数据集中未找到经纬度坐标")
+
+        out = {}
+        for name, var in ds.data_vars.items():
+            if var.dims[-2:] != (lat_name, lon_name):
+                if lat_name not in var.dims and lon_name not in var.dims:
+                    out[name] = var
+                continue
+            dtype = var.dtype if var.dtype.kind == 'f' else np.dtype('f4')
+            # 按内存上限沿前导维（时间、深度等）分块读取，每块只含若干个二维场
+            values = np.empty(var.shape[:-2] + (len(self.dst_lat), len(self.dst_lon)), dtype)
+            for index in iter_slabs(var.shape[:-2], self._field_bytes(), self.max_bytes):
+                values[index] = self.regrid_array(var[index].values)
+            attrs = {k: v for k, v in var.attrs.items()
+                     if k not in ('scale_factor', 'add_offset', '_FillValue')}
+            out[name] = xr.DataArray(values, dims=var.dims, attrs=attrs)
+
+        coords = {name: coord for name, coord in ds.coords.items()
+                  if lat_name not in coord.dims and lon_name not in coord.dims}
+        coords[lat_name] = (lat_name, self.dst_lat, ds[lat_name].attrs)
+        coords[lon_name] = (lon_name, self.dst_lon, ds[lon_name].attrs)
+        result = xr.Dataset(out, coords=coords, attrs=ds.attrs)
+        result.attrs['regrid_method'] = self.method
+        return result
+
+
+def grid_of(path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """读取文件的经纬度坐标"""
+    with xr.open_dataset(path) as ds:
+        lat_name, lon_name = find_coord(ds, LAT_NAMES), find_coord(ds, LON_NAMES)
+        return ds[lat_name].values, ds[lon_name].values
+
+
+# 工作进程内的重插值器，每个进程只加载一次权重
+_worker_regridder: Optional[Regridder] = None
+
+
+def _init_worker(src_grid, dst_grid, method, cache_dir, min_valid_weight,
+                 max_memory_mb) -> None:
+    global _worker_regridder
+    _worker_regridder = Regridder(src_grid[0], src_grid[1], dst_grid[0], dst_grid[1],
+                                  method, cache_dir, min_valid_weight, max_memory_mb)
+
+
+def _regrid_file(src_path: Path, dst_path: Path, complevel: int) -> bool:
+    try:
+        with xr.open_dataset(src_path) as ds:
+            result = _worker_regridder.regrid_dataset(ds)
+        encoding = {name: {'zlib': True, 'complevel': complevel} for name in result.data_vars}
+        tmp_path = dst_path.with_suffix('.nc.tmp')
+        result.to_netcdf(tmp_path, encoding=encoding)
+        tmp_path.replace(dst_path)
+        return True
+    except Exception as e:
+        logger.error(f"重插值失败 {src_path}: {e}")
+        return False
+
+
+def regrid_files(files: List[Path], target_grid: Tuple[np.ndarray, np.ndarray],
+                 output_dir: Path, method: str = 'bilinear',
+                 cache_dir: Optional[Path] = None, workers: int = 2,
+                 min_valid_weight: float = 0.5, suffix: str = '',
+                 complevel: int = 4, overwrite: bool = False,
+                 max_memory_mb: float = 256) -> Dict[str, bool]:
+    """将一组同网格文件并行重插值到目标网格
+
+    权重在主进程计算并写入缓存，工作进程从缓存加载，之后每个文件只做稀疏矩阵乘与 I/O。
+    max_memory_mb 限制每个工作进程插值时的工作内存（不含输出数组）。
+    """
+    if not files:
+        return {}
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    src_grid = grid_of(files[0])
+    # 预先计算并缓存权重，避免每个工作进程重复计算
+    Regridder(src_grid[0], src_grid[1], target_grid[0], target_grid[1],
+              method, cache_dir, min_valid_weight)
+
+    results: Dict[str, bool] = {}
+    jobs = {}
+    for path in files:
+        target = output_dir / f"{path.stem}{suffix}.nc"
+        if target.exists() and not overwrite:
+            results[path.name] = True
+        else:
+            jobs[path] = target
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(src_grid, target_grid, method, cache_dir,
+                                       min_valid_weight, max_memory_mb)) as executor:
+        futures = {executor.submit(_regrid_file, path, target, complevel): path
+                   for path, target in jobs.items()}
+        for current, future in enumerate(as_completed(futures), 1):
+            results[futures[future].name] = future.result()
+            logger.info(f"进度: {current}/{len(futures)} ({current / len(futures) * 100:.1f}%)")
+    return results
+
+
+def colocate(config: Dict[str, Any], source_dataset: str, target_dataset: str,
+             start, end, options: Optional[Dict[str, Any]] = None) -> Dict[str, bool]:
+    """将 source_dataset 在 [start, end] 内的归档文件重插值到 target_dataset 的网格
+
+    输出 {source}_{日期}_on_{target}.nc，与目标数据集同名日期文件按时间配对使用。
+    """
+    from utils.archive_index import ArchiveIndex
+
+    opts = dict(config.get('processing', {}).get('regrid') or {})
+    opts.update(options or {})
+    general_cfg = config.get('general', {})
+    output_base = Path(config.get('output_base_dir')
+                       or general_cfg.get('output_base_dir', './data'))
+
+    index = ArchiveIndex(output_base)
+    index.refresh()
+    target_files = index.query(target_dataset, start, end)
+    if not target_files:
+        raise FileNotFoundError(f"归档中没有目标数据集文件: {target_dataset}")
+    source_files = [path for path, _, _ in index.query(source_dataset, start, end)]
+
+    return regrid_files(
+        source_files, grid_of(target_files[0][0]),
+        Path(opts.get('output_dir') or output_base / 'colocated'),
+        method=opts.get('method', 'bilinear'),
+        cache_dir=Path(opts.get('cache_dir') or output_base / '.regrid_weights'),
+        workers=int(opts.get('workers', 2)),
+        min_valid_weight=float(opts.get('min_valid_weight', 0.5)),
+        suffix=f"_on_{target_dataset}",
+        max_memory_mb=float(opts.get('max_memory_mb', 256)),
+    )